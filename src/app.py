@@ -1,12 +1,35 @@
 import gradio as gr
 import os
 
+from postprocess import PostProcessor
 from super_resolution import YOLOv5ModelWithUpsample
+from video import KeyframeSelector, VideoTracker, process_video
+import instrumentation
+from instrumentation import span
+from runtime import configure_threads
 
 # gradio-docker related
 SERVER_NAME = os.environ.get("SERVER_NAME", "127.0.0.1")
 SERVER_PORT = int(os.environ.get("SERVER_PORT", "7861"))
 
+# detections below the floor, suppressed by NMS or beyond top-k are never evaluated or rendered
+POSTPROCESS = dict(
+    conf_threshold=float(os.environ.get("CONF_THRESHOLD", "0.25")),
+    iou_threshold=float(os.environ.get("NMS_IOU_THRESHOLD", "0.45")),
+    top_k=int(os.environ.get("TOP_K", "100")),
+)
+
+# uploads are processed offline, so detection runs on every frame unless skipping late frames
+# is asked for (how many get skipped then depends on how fast this machine is)
+# keyframe policy: frames differing less than the threshold from the last keyframe reuse its
+# detections (threshold 0 turns this off), with a full detection at least every max_interval frames
+TRACKING = dict(
+    adaptive_skip=os.environ.get("ADAPTIVE_SKIP", "0") == "1",
+    keyframe_threshold=float(os.environ.get("KEYFRAME_THRESHOLD", "4.0")),
+    keyframe_max_interval=int(os.environ.get("KEYFRAME_MAX_INTERVAL", "15")),
+    keyframe_size=int(os.environ.get("KEYFRAME_SIZE", "64")),
+)
+
 
 # tools
 def save_outputs(output):
@@ -22,14 +45,44 @@ def save_outputs(output):
         os.removedirs(default_output_path)
 
     print("Saving output images to", default_output_path)
-    output.save()
+    with span("app.save_outputs"):
+        output.save()
 
     # TODO clean up
     return [
         os.path.join(default_output_path, f)
         for f in os.listdir(default_output_path)
     ]
-    
+
+
+def track_video(
+        video_path, 
+        model, 
+        keyframe_threshold=4.0, 
+        keyframe_max_interval=15, 
+        keyframe_size=64, 
+        adaptive_skip=False,
+    ):
+    output_dir = os.path.join(os.getcwd(), "runs/track/")
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(video_path))[0] + "_mot.mp4")
+
+    print("Tracking", video_path)
+    keyframes = None
+    if keyframe_threshold:
+        keyframes = KeyframeSelector(
+            threshold=keyframe_threshold, max_interval=keyframe_max_interval, size=keyframe_size
+        )
+    stats = process_video(
+        video_path, output_path, VideoTracker(model), adaptive_skip=adaptive_skip, keyframes=keyframes
+    )
+    print(
+        f"Processed {stats['frames']} frames at {stats['fps']:.1f} fps "
+        f"(source {stats['source_fps']:.1f} fps, detection skipped on {stats['skipped']} late "
+        f"and {stats['reused']} near-duplicate frames, {100 * stats['saved_fraction']:.0f}% compute saved)"
+    )
+    return output_path
+
 
 # interface
 def main(
@@ -38,17 +91,31 @@ def main(
         task="object_detection",
     ):
 
-    if task == "object_detection":
+    if task not in ["object_detection", "multi_object_tracking"]:
+        raise NotImplementedError(f"Task {task} is not yet supported.")
+
+    with span("app.model_load"):
         model = YOLOv5ModelWithUpsample(
             detection_model_path="../models/fathomnet_benthic/mbari-mb-benthic-33k.pt",
-            upsample_model_name=super_resolution
+            upsample_model_name=super_resolution,
+            postprocess=PostProcessor(**POSTPROCESS),
         )
 
-    else: # elif task == "multi_object_tracking":
-        raise NotImplementedError("Multi-object tracking is not yet supported.")
+    if task == "multi_object_tracking":
+        with span("app.track"):
+            output_file = track_video(files[0], model, **TRACKING)
+
+        return [
+            gr.Gallery(label="Outputs", value=[]),
+            gr.DownloadButton(label="Download", value=output_file),
+            gr.Video(label="Tracking", value=output_file),
+        ]
 
     # feed files to model
-    outputs = model.forward(files)
+    with span("app.forward"):
+        outputs = model.forward(files)
+
+    print(model.postprocess.summary())
 
     # save output images to "runs/detect/exp"
     output_files = save_outputs(outputs)
@@ -56,41 +123,98 @@ def main(
 
     return [
         gr.Gallery(label="Outputs", value=[(f, f"ele_{i}") for i,f in enumerate(output_files)]),
-        gr.DownloadButton(label="Download", value=output_files[0])
+        gr.DownloadButton(label="Download", value=output_files[0]),
+        gr.Video(label="Tracking", value=None),
     ]
 
 
 interface = gr.Interface(
     fn=main,
     inputs=[
-        gr.Files(label="Images", file_count="multiple"),
+        gr.Files(label="Images (or a video for tracking)", file_count="multiple"),
         gr.Radio(
             ["", "ABPN", "ESRGAN"],
             label="super_resolution",
         ),
         gr.Radio(
-            ["object_detection"],
+            ["object_detection", "multi_object_tracking"],
             label="task",
         )
     ],
     outputs=[
         "gallery",
         gr.DownloadButton(),
+        "video",
     ],
     title="Benthic Object Detection with Super Resolution",
     description="Object detection focused on benthic images with super resolution capabilities."
 )
 
 
+def add_metrics_routes(app):
+    """Expose span timings at /metrics (Prometheus text) and /metrics.json"""
+    from fastapi.responses import JSONResponse, PlainTextResponse
+
+    app.add_api_route(
+        "/metrics", 
+        lambda: PlainTextResponse(instrumentation.to_prometheus()), 
+        methods=["GET"]
+    )
+    app.add_api_route(
+        "/metrics.json", 
+        lambda: JSONResponse(instrumentation.snapshot()), 
+        methods=["GET"]
+    )
+
+
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--server-name", type=str, default=SERVER_NAME)
     parser.add_argument("--server-port", type=int, default=SERVER_PORT)
+    parser.add_argument("--instrument", action="store_true", help="record per-stage timings, served at /metrics")
+    parser.add_argument("--workers", type=int, default=None, help="processes sharing this node's cores")
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads per worker")
+    parser.add_argument("--conf-threshold", type=float, default=POSTPROCESS["conf_threshold"])
+    parser.add_argument("--nms-iou-threshold", type=float, default=POSTPROCESS["iou_threshold"])
+    parser.add_argument("--top-k", type=int, default=POSTPROCESS["top_k"], help="max detections per image")
+    parser.add_argument(
+        "--adaptive-skip", action="store_true", default=TRACKING["adaptive_skip"], 
+        help="skip detection on frames that fall behind (results then depend on hardware speed)"
+    )
+    parser.add_argument(
+        "--keyframe-threshold", type=float, default=TRACKING["keyframe_threshold"], 
+        help="mean pixel difference (0-255) that triggers a new detection, 0 detects on every frame"
+    )
+    parser.add_argument("--keyframe-max-interval", type=int, default=TRACKING["keyframe_max_interval"])
+    parser.add_argument("--keyframe-size", type=int, default=TRACKING["keyframe_size"], help="thumbnail width")
     args = parser.parse_args()
 
+    TRACKING.update(
+        adaptive_skip=args.adaptive_skip,
+        keyframe_threshold=args.keyframe_threshold,
+        keyframe_max_interval=args.keyframe_max_interval,
+        keyframe_size=args.keyframe_size,
+    )
+
+    POSTPROCESS.update(
+        conf_threshold=args.conf_threshold,
+        iou_threshold=args.nms_iou_threshold,
+        top_k=args.top_k,
+    )
+
+    print("Thread budget:", configure_threads(workers=args.workers, intra_op=args.threads))
+
     SERVER_NAME = args.server_name
     SERVER_PORT = args.server_port
-    
-    interface.launch(server_name=SERVER_NAME, server_port=SERVER_PORT)
\ No newline at end of file
+
+    if args.instrument:
+        instrumentation.enable()
+
+    if instrumentation.ENABLED:
+        interface.launch(server_name=SERVER_NAME, server_port=SERVER_PORT, prevent_thread_lock=True)
+        add_metrics_routes(interface.app)
+        interface.block_thread()
+    else:
+        interface.launch(server_name=SERVER_NAME, server_port=SERVER_PORT)
\ No newline at end of file
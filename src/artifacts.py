@@ -0,0 +1,180 @@
+"""
+TorchScript / ONNX export with a persistent on-disk artifact cache.
+
+Artifacts are keyed by the hash of the weights file plus the input shape, dtype and device
+(traced graphs hold device bound constants), so a traced graph is only ever produced once
+per machine and later processes load the optimized graph directly:
+
+    ~/.cache/ocean-species-identification/yolov5-benthic-<hash>-1x3x384x640-float32-cpu.pt
+
+CompiledModule wraps an eager module and dispatches every input shape to its own
+cached artifact, exporting it the first time a shape shows up. Traced graphs bake in
+shape dependent constants (e.g. YOLOv5's detection grids), hence one artifact per shape.
+"""
+from functools import lru_cache
+from pathlib import Path
+from time import perf_counter
+
+import hashlib
+import os
+import torch
+
+try:
+    from src.instrumentation import span
+    from src.runtime import onnx_session_options
+except ImportError:
+    from instrumentation import span
+    from runtime import onnx_session_options
+
+
+CACHE_DIR = os.environ.get(
+    "ARTIFACT_CACHE",
+    os.path.join(Path.home(), ".cache", "ocean-species-identification")
+)
+FORMATS = {"torchscript": ".pt", "onnx": ".onnx"}
+
+
+@lru_cache(maxsize=None)
+def _file_hash(path: str, mtime: float, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_hash(path: str) -> str:
+    """sha256 of a weights file, memoized per (path, mtime, size)."""
+    stat = os.stat(path)
+    return _file_hash(os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+
+def artifact_path(name: str, weights_hash: str, example: torch.Tensor, fmt: str, cache_dir: str = None) -> str:
+    shape = "x".join(str(d) for d in example.shape)
+    dtype = str(example.dtype).replace("torch.", "")
+    device = str(example.device).replace(":", "")
+    return os.path.join(
+        cache_dir or CACHE_DIR,
+        f"{name}-{weights_hash[:16]}-{shape}-{dtype}-{device}{FORMATS[fmt]}"
+    )
+
+
+def export_torchscript(module: torch.nn.Module, example: torch.Tensor, path: str) -> None:
+    with torch.no_grad():
+        # strict=False: detectors return lists of feature maps next to the predictions
+        traced = torch.jit.trace(module.eval(), example, strict=False)
+        try:
+            traced = torch.jit.freeze(traced)
+        except RuntimeError:
+            pass  # not every graph can be frozen, the plain trace still works
+    _atomic_save(lambda tmp: torch.jit.save(traced, tmp), path)
+
+
+def export_onnx(module: torch.nn.Module, example: torch.Tensor, path: str) -> None:
+    with torch.no_grad():
+        _atomic_save(
+            lambda tmp: torch.onnx.export(module.eval(), example, tmp, opset_version=17, do_constant_folding=True),
+            path
+        )
+
+
+def _atomic_save(save, path: str) -> None:
+    # write next to the target and rename, so concurrent workers never load half an artifact
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    save(tmp)
+    os.replace(tmp, path)
+
+
+def load_artifact(path: str, fmt: str):
+    if fmt == "torchscript":
+        module = torch.jit.load(path).eval()
+        try:
+            # backend specific rewrites (e.g. conv + bn folding, mkldnn) don't serialize, so apply them on load
+            module = torch.jit.optimize_for_inference(module)
+        except (RuntimeError, AttributeError):
+            pass
+        return module
+
+    import onnxruntime
+    return onnxruntime.InferenceSession(path, sess_options=onnx_session_options())
+
+
+def load_or_export(
+        name: str,
+        weights_path: str,
+        module: torch.nn.Module,
+        example: torch.Tensor,
+        fmt: str = "torchscript",
+        cache_dir: str = None,
+    ):
+    """
+    Load the cached artifact for (weights, example shape), exporting it from module first if missing.
+
+    Returns:
+        tuple: (artifact, stats) where stats has the path, whether it was a cache hit and the time taken
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Artifact format {fmt} not recognized, use one of {list(FORMATS)}")
+
+    path = artifact_path(name, file_hash(weights_path), example, fmt, cache_dir)
+    hit = os.path.isfile(path)
+    start = perf_counter()
+
+    if not hit:
+        print(f"Exporting {name} {tuple(example.shape)} to {path}")
+        with span(f"artifacts.export.{fmt}"):
+            (export_torchscript if fmt == "torchscript" else export_onnx)(module, example, path)
+
+    with span(f"artifacts.load.{fmt}"):
+        artifact = load_artifact(path, fmt)
+
+    return artifact, {"path": path, "hit": hit, "time": perf_counter() - start}
+
+
+class CompiledModule(torch.nn.Module):
+    """
+    Drop-in replacement for an eager module, running a cached TorchScript/ONNX artifact per input shape.
+    The eager module stays registered, so .parameters()/.to() keep working for callers that use them.
+    """
+
+    def __init__(
+            self,
+            module: torch.nn.Module,
+            name: str,
+            weights_path: str,
+            fmt: str = "torchscript",
+            cache_dir: str = None
+        ):
+        super().__init__()
+        self.module = module
+        self.name = name
+        self.weights_path = weights_path
+        self.fmt = fmt
+        self.cache_dir = cache_dir
+        self.compiled = {}
+        self.load_stats = []
+
+    def __getitem__(self, index):
+        # yolov5's AutoShape._apply (.to()/.cuda()/.half()) reaches for the Detect layer
+        # through DetectMultiBackend.model[-1], so indexing goes to the eager module
+        return self.module[index]
+
+    def artifact(self, x: torch.Tensor):
+        key = (tuple(x.shape), x.dtype, x.device)
+        if key not in self.compiled:
+            self.compiled[key], stats = load_or_export(
+                self.name, self.weights_path, self.module, x, self.fmt, self.cache_dir
+            )
+            self.load_stats.append(stats)
+        return self.compiled[key]
+
+    def forward(self, x: torch.Tensor, *args, **kwargs):
+        artifact = self.artifact(x)
+        if self.fmt == "torchscript":
+            return artifact(x)
+
+        session = artifact
+        outputs = session.run(None, {session.get_inputs()[0].name: x.detach().cpu().numpy()})
+        outputs = [torch.from_numpy(o).to(x.device) for o in outputs]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
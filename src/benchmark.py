@@ -0,0 +1,477 @@
+"""
+Offline benchmark suite for the evaluation hot paths, SR backends and detection.
+
+Run from the repo root:
+
+    python -m src.benchmark --output runs/bench/current.json
+    python -m src.benchmark --baseline runs/bench/baseline.json --threshold 0.15
+
+Results are written as JSON. When a baseline is given, every benchmark present in both runs
+is compared on its median time, and the process exits with status 1 if any of them got slower
+than the threshold allows.
+Benchmarks whose dependencies or weights are missing are recorded as skipped, not failed.
+
+Each benchmark runs in a fresh process, so rss_delta_mb (growth of the peak resident set while
+it ran) includes native allocations by torch/onnxruntime/OpenCV (and the imports the benchmark
+triggers) and is not inflated by earlier benchmarks. Pass --no-isolate to run everything in this process instead.
+SR benchmarks also report rss_peak_mb per frame size: the peak RSS growth of a single enhance()
+call, measured in its own process after the model is loaded.
+"""
+from pathlib import Path
+from queue import Empty
+from time import perf_counter
+
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tracemalloc
+
+
+EXAMPLE_DIR = Path("data") / "example"
+MBA_DIR = EXAMPLE_DIR / "mba"
+VIDEO_PATH = EXAMPLE_DIR / "sea_feather.mp4"
+
+BOX_COUNTS = [10, 100, 500]
+FRAME_SIZES = [(120, 160), (240, 320), (480, 640)]  # (H, W) of synthetic frames
+
+
+# helpers
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def time_fn(fn, repeats: int = 5, warmup: int = 1) -> dict:
+    """
+    Time fn() repeats times after warmup calls.
+    The python-side memory peak is measured in one extra call afterwards, tracing allocations
+    slows python code down several times, so it must not overlap with the timed calls.
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "max": max(times),
+        "repeats": repeats,
+        "py_peak_mb": peak / 2**20,
+    }
+
+
+def random_boxes(n: int, size: int = 1000, seed: int = 0, with_conf: bool = True, n_classes: int = 5):
+    rng = random.Random(seed)
+    boxes = []
+    for _ in range(n):
+        x1, y1 = rng.uniform(0, size - 50), rng.uniform(0, size - 50)
+        x2, y2 = x1 + rng.uniform(5, 50), y1 + rng.uniform(5, 50)
+        cls = rng.randrange(n_classes)
+        boxes.append((x1, y1, x2, y2, rng.random(), cls) if with_conf else (x1, y1, x2, y2, cls))
+    return boxes
+
+
+def synthetic_frame(h: int, w: int, seed: int = 0):
+    import numpy as np
+    return np.random.default_rng(seed).integers(0, 256, (h, w, 3), dtype=np.uint8)
+
+
+def example_frames(n: int = 8):
+    return sorted(str(p) for p in MBA_DIR.glob("*.jpg"))[:n]
+
+
+def _call(queue, fn, args):
+    try:
+        queue.put((True, fn(*args)))
+    except (ImportError, FileNotFoundError, ValueError) as e:
+        queue.put((False, e))
+    except Exception as e:
+        # native library exceptions don't always pickle
+        queue.put((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+def in_subprocess(fn, *args):
+    """Run fn(*args) in a fresh spawned process and return its result, re-raising its exception."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_call, args=(queue, fn, args))
+    process.start()
+    try:
+        while True:
+            try:
+                ok, result = queue.get(timeout=1)
+                break
+            except Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"{fn.__name__} died with exit code {process.exitcode}")
+    finally:
+        process.join()
+
+    if not ok:
+        raise result
+    return result
+
+
+def upsample_model(name: str, models_dir: str):
+    """ABPN or ESRGAN with weights from models_dir (the models' own defaults assume running from src/)."""
+    from src.super_resolution import ABPN, ESRGAN
+
+    if name == "ABPN":
+        model_path = os.path.join(models_dir, "sr_mobile_python", "models_modelx4.ort")
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(model_path)
+        return ABPN(model_path=model_path, store=False)
+    if name == "ESRGAN":
+        return ESRGAN(model_dir=os.path.join(models_dir, "ESRGAN"), model_name="RealESRGAN_x4plus")
+    raise ValueError(f"Upsample model {name} not recognized")
+
+
+def sr_frames() -> dict:
+    """label -> (h, w) of a synthetic frame, or the path of an example image"""
+    frames = {f"{h}x{w}": (h, w) for h, w in FRAME_SIZES}
+
+    import cv2
+    for path in example_frames(1):
+        h, w = cv2.imread(path).shape[:2]
+        frames[f"mba_{h}x{w}"] = path
+    return frames
+
+
+def load_frame(frame):
+    import cv2
+    return cv2.imread(frame) if isinstance(frame, str) else synthetic_frame(*frame)
+
+
+def sr_peak_rss(name: str, models_dir: str, frame) -> float:
+    """Peak RSS growth (MB) of one enhance() call on frame, run in a fresh process by bench_sr."""
+    model = upsample_model(name, models_dir)
+    model.enhance(synthetic_frame(32, 32))  # sessions and lazily built buffers don't count
+    img = load_frame(frame)
+    start = peak_rss_mb()
+    model.enhance(img)
+    return peak_rss_mb() - start
+
+
+# benchmarks
+def bench_calculate_iou(repeats: int, **kwargs) -> dict:
+    from src.evaluation import calculate_iou
+
+    results = {}
+    for n in BOX_COUNTS:
+        a = random_boxes(n, seed=1)
+        b = random_boxes(n, seed=2)
+        results[f"calculate_iou/{n}x{n}"] = time_fn(
+            lambda: [calculate_iou(p, t) for p in a for t in b], repeats=repeats
+        )
+    return results
+
+
+def bench_evaluate_bboxes(repeats: int, **kwargs) -> dict:
+    from src.evaluation import evaluate_bboxes
+
+    results = {}
+    for n in BOX_COUNTS:
+        preds = random_boxes(n, seed=1)
+        trues = random_boxes(n, seed=2, with_conf=False)
+        # evaluate_bboxes deletes matched true boxes, so hand it a fresh list every call
+        results[f"evaluate_bboxes/{n}"] = time_fn(
+            lambda: evaluate_bboxes(preds, list(trues)), repeats=repeats
+        )
+    return results
+
+
+def bench_postprocess(repeats: int, **kwargs) -> dict:
+    """Pruning cost, and evaluate_bboxes on the raw vs pruned predictions."""
+    import torch
+    from src.evaluation import evaluate_bboxes
+    from src.postprocess import PostProcessor
+
+    post = PostProcessor()
+    results = {}
+    for n in BOX_COUNTS:
+        preds = torch.tensor(random_boxes(n, seed=1))
+        trues = random_boxes(n, seed=2, with_conf=False)
+        pruned, removed = post.prune(preds)
+
+        results[f"postprocess/{n}"] = time_fn(lambda: post.prune(preds), repeats=repeats)
+        results[f"postprocess/{n}"].update(kept=len(pruned), **removed)
+        results[f"evaluate_bboxes_raw/{n}"] = time_fn(
+            lambda: evaluate_bboxes(preds, list(trues)), repeats=repeats
+        )
+        results[f"evaluate_bboxes_pruned/{n}"] = time_fn(
+            lambda: evaluate_bboxes(pruned, list(trues)), repeats=repeats
+        )
+    return results
+
+
+def bench_sr(name: str, repeats: int, models_dir: str) -> dict:
+    results = {}
+    model = upsample_model(name, models_dir)
+
+    for label, frame in sr_frames().items():
+        img = load_frame(frame)
+        stats = time_fn(lambda: model.enhance(img), repeats=repeats)
+        megapixels = img.shape[0] * img.shape[1] / 1e6
+        stats["megapixels"] = megapixels
+        stats["mpix_per_s"] = megapixels / stats["median"]
+        stats["rss_peak_mb"] = in_subprocess(sr_peak_rss, name, models_dir, frame)
+        results[f"sr/{name}/{label}"] = stats
+    return results
+
+
+def bench_abpn(repeats: int, models_dir: str, **kwargs) -> dict:
+    return bench_sr("ABPN", repeats, models_dir)
+
+
+def bench_esrgan(repeats: int, models_dir: str, **kwargs) -> dict:
+    return bench_sr("ESRGAN", repeats, models_dir)
+
+
+def bench_detection(repeats: int, models_dir: str, upsample_model_name: str = "", **kwargs) -> dict:
+    from src.super_resolution import YOLOv5ModelWithUpsample
+    detection_model_path = os.path.join(models_dir, "fathomnet_benthic", "mbari-mb-benthic-33k.pt")
+    if not os.path.isfile(detection_model_path):
+        raise FileNotFoundError(detection_model_path)
+
+    model = YOLOv5ModelWithUpsample(
+        detection_model_path=detection_model_path,
+        upsample_model=upsample_model(upsample_model_name, models_dir) if upsample_model_name else None,
+    )
+    frames = example_frames()
+    stats = time_fn(lambda: model.forward(frames), repeats=repeats)
+    stats["frames_per_s"] = len(frames) / stats["median"]
+    return {f"detection/{upsample_model_name or 'none'}/{len(frames)}_frames": stats}
+
+
+def bench_detection_postprocess(repeats: int, models_dir: str, **kwargs) -> dict:
+    """
+    The real detector with yolov5's own NMS vs a PostProcessor owning NMS and top-k,
+    including evaluate_bboxes and Detections.save() rendering of what comes out.
+    """
+    import tempfile
+    from src.evaluation import evaluate_bboxes
+    from src.postprocess import PostProcessor
+    from src.super_resolution import YOLOv5ModelWithUpsample
+
+    detection_model_path = os.path.join(models_dir, "fathomnet_benthic", "mbari-mb-benthic-33k.pt")
+    if not os.path.isfile(detection_model_path):
+        raise FileNotFoundError(detection_model_path)
+
+    frames = example_frames()
+    results = {}
+    for label, postprocess in [("autoshape", None), ("postprocess", PostProcessor())]:
+        model = YOLOv5ModelWithUpsample(detection_model_path=detection_model_path, postprocess=postprocess)
+        detections = model.forward(frames)
+        counts = dict(postprocess.stats) if postprocess else {}
+        preds = [pred.tolist() for pred in detections.xyxy]
+        # the model's own detections stand in for ground truth, only the matching cost matters here
+        trues = [[[*box[:4], int(box[5])] for box in pred] for pred in preds]
+
+        stats = time_fn(lambda: model.forward(frames), repeats=repeats)
+        stats["boxes"] = sum(len(pred) for pred in preds)
+        stats["evaluate_s"] = time_fn(
+            lambda: [evaluate_bboxes(p, list(t)) for p, t in zip(preds, trues)], repeats=repeats
+        )["median"]
+        with tempfile.TemporaryDirectory() as save_dir:
+            stats["render_s"] = time_fn(
+                lambda: detections.save(save_dir=save_dir, exist_ok=True), repeats=1, warmup=0
+            )["median"]
+        stats.update(counts)
+        results[f"detection_postprocess/{label}/{len(frames)}_frames"] = stats
+    return results
+
+
+def one_shot(seconds: float) -> dict:
+    return {"median": seconds, "min": seconds, "max": seconds, "repeats": 1}
+
+
+def bench_compiled(repeats: int, models_dir: str, compile_format: str = "torchscript", **kwargs) -> dict:
+    """Cold start (export vs cached load) and steady state (eager vs compiled) for ESRGAN and the detector."""
+    import tempfile
+    import torch
+    from src.artifacts import CompiledModule, load_or_export
+    from src.super_resolution import ESRGAN, YOLOv5ModelWithUpsample
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        esrgan = ESRGAN(model_dir=os.path.join(models_dir, "ESRGAN"), model_name="RealESRGAN_x4plus")
+        h, w = FRAME_SIZES[0]
+        img = synthetic_frame(h, w)
+        example = torch.rand(1, 3, h, w)
+        name = "esrgan-RealESRGAN_x4plus"
+
+        results["compiled/esrgan/eager"] = time_fn(lambda: esrgan.enhance(img), repeats=repeats)
+        for label in ["cold_export", "warm_load"]:
+            _, stats = load_or_export(name, esrgan.model_path, esrgan.upsampler.model, example, compile_format, cache_dir)
+            results[f"compiled/esrgan/{compile_format}_{label}"] = one_shot(stats["time"])
+
+        esrgan.upsampler.model = CompiledModule(
+            esrgan.upsampler.model, name, esrgan.model_path, fmt=compile_format, cache_dir=cache_dir
+        )
+        results[f"compiled/esrgan/{compile_format}"] = time_fn(lambda: esrgan.enhance(img), repeats=repeats)
+
+        detection_model_path = os.path.join(models_dir, "fathomnet_benthic", "mbari-mb-benthic-33k.pt")
+        if not os.path.isfile(detection_model_path):
+            raise FileNotFoundError(detection_model_path)
+
+        model = YOLOv5ModelWithUpsample(detection_model_path=detection_model_path)
+        frames = example_frames()
+        results["compiled/detection/eager"] = time_fn(lambda: model.forward(frames), repeats=repeats)
+
+        model.compile_detector(detection_model_path, compile_format, cache_dir=cache_dir)
+        start = perf_counter()
+        model.forward(frames)  # exports one artifact per letterboxed shape
+        results[f"compiled/detection/{compile_format}_cold_export"] = one_shot(perf_counter() - start)
+        results[f"compiled/detection/{compile_format}"] = time_fn(lambda: model.forward(frames), repeats=repeats)
+
+    for stage in ["esrgan", "detection"]:
+        eager = results[f"compiled/{stage}/eager"]["median"]
+        results[f"compiled/{stage}/{compile_format}"]["speedup"] = eager / results[f"compiled/{stage}/{compile_format}"]["median"]
+    return results
+
+
+def bench_decode(repeats: int, **kwargs) -> dict:
+    import cv2
+
+    def decode_video():
+        cap = cv2.VideoCapture(str(VIDEO_PATH))
+        n = 0
+        while cap.read()[0]:
+            n += 1
+        cap.release()
+        return n
+
+    frames = example_frames(len(list(MBA_DIR.glob("*.jpg"))))
+    n_video_frames = decode_video()
+
+    video = time_fn(decode_video, repeats=repeats)
+    video["frames_per_s"] = n_video_frames / video["median"]
+    images = time_fn(lambda: [cv2.imread(f) for f in frames], repeats=repeats)
+    images["frames_per_s"] = len(frames) / images["median"]
+    return {"decode/sea_feather.mp4": video, "decode/mba_jpg": images}
+
+
+BENCHMARKS = {
+    "iou": bench_calculate_iou,
+    "evaluate_bboxes": bench_evaluate_bboxes,
+    "postprocess": bench_postprocess,
+    "decode": bench_decode,
+    "abpn": bench_abpn,
+    "esrgan": bench_esrgan,
+    "detection": bench_detection,
+    "detection_postprocess": bench_detection_postprocess,
+    "compiled": bench_compiled,
+}
+
+
+# running and comparing
+def environment() -> dict:
+    env = {"python": sys.version.split()[0], "platform": platform.platform(), "cpu_count": os.cpu_count()}
+    for module in ["numpy", "cv2", "torch", "onnxruntime"]:
+        try:
+            env[module] = __import__(module).__version__
+        except ImportError:
+            env[module] = None
+    return env
+
+
+def measure(name: str, repeats: int, kwargs: dict) -> dict:
+    """Run one benchmark, adding the growth of the peak RSS while it ran to each of its results."""
+    start_rss = peak_rss_mb()
+    results = BENCHMARKS[name](repeats=repeats, **kwargs)
+    rss_delta = peak_rss_mb() - start_rss
+    for stats in results.values():
+        stats["rss_delta_mb"] = rss_delta
+    return results
+
+
+def run(names=None, repeats: int = 5, isolate: bool = True, **kwargs) -> dict:
+    results, skipped, failed = {}, {}, {}
+    for name in names or BENCHMARKS:
+        print(f"Running {name}...")
+        try:
+            if isolate:
+                # fresh process per benchmark, so peak RSS starts from the bare interpreter + imports
+                results.update(in_subprocess(measure, name, repeats, kwargs))
+            else:
+                results.update(measure(name, repeats, kwargs))
+        except (ImportError, FileNotFoundError, ValueError) as e:
+            print(f"Skipping {name}: {e}")
+            skipped[name] = str(e)
+        except RuntimeError as e:
+            # keep going, so one broken backend doesn't lose the other results
+            print(f"Failed {name}: {e}")
+            failed[name] = str(e)
+
+    return {"environment": environment(), "results": results, "skipped": skipped, "failed": failed}
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.1) -> dict:
+    """Return {name: ratio} of benchmarks whose median is more than threshold slower than baseline."""
+    regressions = {}
+    for name, stats in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        ratio = stats["median"] / baseline["results"][name]["median"]
+        if ratio > 1 + threshold:
+            regressions[name] = ratio
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*", help=f"any of {list(BENCHMARKS)}, default: all")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--models-dir", type=str, default="models")
+    parser.add_argument("--upsample-model-name", type=str, default="", help="SR model used in the detection benchmark")
+    parser.add_argument("--compile-format", type=str, default="torchscript", help="artifact format for the compiled benchmark")
+    parser.add_argument("--output", type=str, default="runs/bench/latest.json")
+    parser.add_argument("--baseline", type=str, default=None)
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown vs baseline")
+    parser.add_argument("--no-isolate", action="store_true", help="run all benchmarks in this process")
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks {sorted(unknown)}")
+
+    report = run(
+        args.benchmarks,
+        repeats=args.repeats,
+        isolate=not args.no_isolate,
+        models_dir=args.models_dir,
+        upsample_model_name=args.upsample_model_name,
+        compile_format=args.compile_format,
+    )
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results saved to", args.output)
+
+    for name, stats in report["results"].items():
+        print(f"{name:40s} {stats['median'] * 1e3:10.3f} ms {stats['rss_delta_mb']:8.1f} MB")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+
+        for name, ratio in regressions.items():
+            print(f"REGRESSION {name}: {ratio:.2f}x baseline")
+        sys.exit(1 if regressions else 0)
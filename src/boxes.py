@@ -0,0 +1,22 @@
+"""
+Box geometry shared by evaluation and tracking, kept free of heavier dependencies
+(scipy, pycocotools, fathomnet) so either side can import it.
+"""
+import numpy as np
+
+
+def iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy boxes, returns (N, M)."""
+    boxes1 = np.asarray(boxes1, dtype=np.float64)[:, None, :4]
+    boxes2 = np.asarray(boxes2, dtype=np.float64)[None, :, :4]
+
+    wh = np.clip(
+        np.minimum(boxes1[..., 2:], boxes2[..., 2:]) - np.maximum(boxes1[..., :2], boxes2[..., :2]),
+        0, None
+    )
+    intersection = wh[..., 0] * wh[..., 1]
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+    union = area1 + area2 - intersection
+
+    return np.where(union > 0, intersection / np.where(union > 0, union, 1), 0.0)
@@ -7,6 +7,11 @@ from typing import List
 import os 
 import numpy as np 
 
+try:
+    from src.instrumentation import span
+except ImportError:
+    from instrumentation import span
+
 
 def full_path(filename: str, prefix: str) -> str:
     return os.path.join(prefix, filename)
@@ -54,6 +59,34 @@ def anns_per_category(category: str, data: COCO, N: int=-1):
     ]
 
 
+def batches_per_category(
+        category: str, 
+        data: COCO, 
+        batch_size: int = 16,
+        path_prefix: str = "", 
+        N: int = -1,
+        **kwargs
+    ):
+    """
+    Lazily yield (image_paths, anns) pairs for a category, batch_size images at a time,
+    so detections and annotations never need to be held for the full category at once.
+    """
+    image_ids = category2image_ids(category, data)[:N]
+
+    for i in range(0, len(image_ids), batch_size):
+        batch_ids = image_ids[i:i + batch_size]
+        with span("data.anns"):
+            image_paths = [
+                full_path(r["file_name"], path_prefix) 
+                for r in data.loadImgs(batch_ids)
+            ]
+            anns = [
+                preprocess_anns(data.loadAnns(data.getAnnIds(imgIds=id)))
+                for id in batch_ids
+            ]
+        yield image_paths, anns
+
+
 def preprocess_anns(anns: List[dict]):
     """
     Preprocess annotation to match detection format
@@ -1,10 +1,16 @@
-from src.data import detections_per_category, anns_per_category
+from src.data import detections_per_category, anns_per_category, batches_per_category
+from src.instrumentation import span
+from src.runtime import configure_threads
+from src.labels import LabelMap
+from src.boxes import iou_matrix
 from time import time
 from pycocotools.coco import COCO
 from fathomnet.models.yolov5 import YOLOv5Model
 
 from typing import List, Any 
 
+import numpy as np
+
 def calculate_iou(box1, box2):
     # Calculate intersection coordinates
     x1_intersection = max(box1[0], box2[0])
@@ -28,7 +34,7 @@ def calculate_iou(box1, box2):
     return iou
 
 
-def evaluate_bboxes(
+def match_bboxes(
         pred_boxes, 
         true_boxes, 
         iou_threshold=0.5, 
@@ -38,24 +44,26 @@ def evaluate_bboxes(
         exclude_ids=[],
         x_scale=1.0,
         y_scale=1.0,
+        label_map: LabelMap=None,
         **kwargs
     ):
     """
-    Single row evaluation of predicted and true boxes. Returns precision and recall.
+    Greedy matching of predicted boxes to true boxes for a single image.
+    Matched true boxes are removed from true_boxes, so whatever is left 
+    after the call are the false negatives.
 
     args:
-        pred_boxes (list): (x1, y1, x2, y2, confidence, class_id) for each predicted box
-        true_boxes (list): (x1, y1, x2, y2, class_id) for each ground truth box
-        iou_threshold (float): threshold for considering a predicted box a true positive
-        id_map (dict): mapping of class ids from the Benthic model to the TrashCAN model
-        one_idx (int): benthic class id of the one class
-        many_idx (list): trashcan class ids of the many class
-        exclude_ids (list): true class ids to exclude from evaluation
+        see evaluate_bboxes
+
+    returns:
+        list[tuple]: (pred_class_id, best_iou, matched) for each predicted box
     """
-    tp = 0  # True positives
-    fp = 0  # False positives
-    fn = 0  # False negatives
-    ious = []
+    if label_map is not None:
+        return match_bboxes_vectorized(
+            pred_boxes, true_boxes, label_map, iou_threshold=iou_threshold, x_scale=x_scale, y_scale=y_scale
+        )
+
+    matches = []
 
     # Loop through predicted boxes
     for pred_box in pred_boxes:
@@ -98,13 +106,118 @@ def evaluate_bboxes(
                 best_match_index = i
 
         # If IoU is greater than threshold, consider it a true positive
-        if best_iou >= iou_threshold:
-            tp += 1
+        matched = bool(best_iou >= iou_threshold)
+        if matched:
             del true_boxes[best_match_index]  # Remove matched true box
-        else:
-            fp += 1
 
-        ious.append(best_iou)
+        matches.append((pred_class_id, best_iou, matched))
+
+    return matches
+
+
+def match_bboxes_vectorized(
+        pred_boxes, 
+        true_boxes, 
+        label_map: LabelMap, 
+        iou_threshold=0.5, 
+        x_scale=1.0, 
+        y_scale=1.0
+    ):
+    """
+    match_bboxes using the compiled lookup tables of a LabelMap: class remapping and exclusions 
+    are resolved for all boxes at once, and IoUs come from a single (P, T) matrix. 
+    Predictions are still matched greedily in order, with the same results as match_bboxes
+    (see tests/test_evaluation.py), with one exception: a prediction that overlaps no remaining 
+    true box of its class is never a match. With iou_threshold=0, match_bboxes counts it as one 
+    and deletes the last true box instead.
+    """
+    preds = label_map.remap_detections(pred_boxes)
+    if not len(true_boxes):
+        return [(int(c), 0, False) for c in preds[:, 5]]
+
+    trues = np.asarray(true_boxes, dtype=np.float64).reshape(-1, 5)
+    # scale true annotations to new image size
+    true_coords = (trues[:, :4] * [x_scale, y_scale, x_scale, y_scale]).astype(np.int64)
+    true_ids = trues[:, 4].astype(np.int64)
+
+    ious = iou_matrix(preds[:, :4], true_coords)
+    ious[:, label_map.is_excluded(true_ids)] = 0
+    same_class = preds[:, 5:6].astype(np.int64) == true_ids[None, :]
+    many = label_map.is_many(true_ids)
+    order = np.arange(len(trues))
+
+    matches = []
+    available = np.ones(len(trues), dtype=bool)
+    for p in range(len(preds)):
+        pred_class_id = int(preds[p, 5])
+        candidates = same_class[p]
+
+        # like match_bboxes: the one class takes the class of the first remaining "many" box,
+        # for that box and every box after it. A "many" box of the one class itself leaves the 
+        # prediction at one_idx, so the loop carries on to the next "many" box
+        if pred_class_id == label_map.one_idx:
+            first_many = np.flatnonzero(available & many & (true_ids != label_map.one_idx))
+            if len(first_many):
+                j = first_many[0]
+                pred_class_id = int(true_ids[j])
+                candidates = true_ids == np.where(order >= j, pred_class_id, label_map.one_idx)
+
+        row = np.where(available & candidates, ious[p], 0)
+        best = int(row.argmax())
+        best_iou = float(row[best])
+        matched = best_iou >= iou_threshold and best_iou > 0
+
+        if matched:
+            available[best] = False
+        matches.append((pred_class_id, best_iou, matched))
+
+    # Remove matched true boxes, like match_bboxes
+    true_boxes[:] = [box for box, keep in zip(true_boxes, available) if keep]
+    return matches
+
+
+def evaluate_bboxes(
+        pred_boxes, 
+        true_boxes, 
+        iou_threshold=0.5, 
+        id_map=None,
+        one_idx=None,
+        many_idx=[],
+        exclude_ids=[],
+        x_scale=1.0,
+        y_scale=1.0,
+        label_map: LabelMap=None,
+        **kwargs
+    ):
+    """
+    Single row evaluation of predicted and true boxes. Returns precision and recall.
+
+    args:
+        pred_boxes (list): (x1, y1, x2, y2, confidence, class_id) for each predicted box
+        true_boxes (list): (x1, y1, x2, y2, class_id) for each ground truth box
+        iou_threshold (float): threshold for considering a predicted box a true positive
+        id_map (dict): mapping of class ids from the Benthic model to the TrashCAN model
+        one_idx (int): benthic class id of the one class
+        many_idx (list): trashcan class ids of the many class
+        exclude_ids (list): true class ids to exclude from evaluation
+        label_map (LabelMap): compiled id_map/one_idx/many_idx/exclude_ids, replaces them when given
+    """
+    matches = match_bboxes(
+        pred_boxes, 
+        true_boxes, 
+        iou_threshold=iou_threshold, 
+        id_map=id_map, 
+        one_idx=one_idx, 
+        many_idx=many_idx, 
+        exclude_ids=exclude_ids, 
+        x_scale=x_scale, 
+        y_scale=y_scale,
+        label_map=label_map,
+    )
+
+    tp = int(sum(matched for _, _, matched in matches))  # True positives
+    fp = len(matches) - tp  # False positives
+    ious = [iou for _, iou, _ in matches]
 
     # Any remaining true boxes are false negatives
     fn = len(true_boxes)
@@ -170,21 +283,27 @@ def evaluate_model(
         N: int=-1, 
         **kwargs
     ):
+    configure_threads()
     start = time()
-    detections = detections_per_category(
-        category=category, data=data, model=model, N=N, **kwargs
-    )
-    anns = anns_per_category(category=category, data=data, N=N)
+    with span("evaluation.detect"):
+        detections = detections_per_category(
+            category=category, data=data, model=model, N=N, **kwargs
+        )
+    with span("evaluation.anns"):
+        anns = anns_per_category(category=category, data=data, N=N)
 
-    precision, recall, ious = evaluate_detections(
-        detections=detections, 
-        anns=anns, 
-        id_map=id_map, 
-        N=N, 
-        **kwargs
-    )
+    with span("evaluation.match"):
+        precision, recall, ious = evaluate_detections(
+            detections=detections, 
+            anns=anns, 
+            id_map=id_map, 
+            N=N, 
+            **kwargs
+        )
 
     print_precision_recall_iou(precision, recall, ious) if verbose else None
+    if verbose and getattr(model, "postprocess", None):
+        print(model.postprocess.summary())
     if verbose > 1:
         detections.show()
 
@@ -194,3 +313,176 @@ def evaluate_model(
         "iou": sum(ious) / len(ious), 
         "time": time() - start
     }
+
+
+class EvaluationAccumulator:
+    """
+    Streaming version of evaluate_detections.
+    Consumes detections and annotations batch by batch, keeping only fixed-size state:
+    per-class confusion counts (tp, fp, fn) and per-class IoU histograms.
+    Accumulators from different workers can be combined with merge (or +).
+
+    Args:
+        num_classes (int): number of (mapped) class ids to track, grows if a larger id shows up
+        n_bins (int): number of IoU histogram bins over [0, 1]
+        id_map (dict): mapping of class ids from the Benthic model to the TrashCAN model
+        **kwargs: passed on to match_bboxes (iou_threshold, one_idx, many_idx, exclude_ids, ...)
+    """
+
+    def __init__(
+            self, 
+            num_classes: int = 32, 
+            n_bins: int = 20, 
+            id_map: dict = None, 
+            **kwargs
+        ):
+        self.n_bins = n_bins
+        self.id_map = id_map
+        self.match_kwargs = kwargs
+
+        self.tp = np.zeros(num_classes, dtype=np.int64)
+        self.fp = np.zeros(num_classes, dtype=np.int64)
+        self.fn = np.zeros(num_classes, dtype=np.int64)
+        self.iou_hist = np.zeros((num_classes, n_bins), dtype=np.int64)
+        self.iou_sum = np.zeros(num_classes, dtype=np.float64)
+        self.n_images = 0
+
+    @property
+    def num_classes(self) -> int:
+        return len(self.tp)
+
+    def _grow(self, class_id: int) -> None:
+        # only ever grows to the largest class id seen, so state stays bounded
+        if class_id < self.num_classes:
+            return
+        pad = class_id + 1 - self.num_classes
+        self.tp = np.pad(self.tp, (0, pad))
+        self.fp = np.pad(self.fp, (0, pad))
+        self.fn = np.pad(self.fn, (0, pad))
+        self.iou_hist = np.pad(self.iou_hist, ((0, pad), (0, 0)))
+        self.iou_sum = np.pad(self.iou_sum, (0, pad))
+
+    def _bin(self, iou: float) -> int:
+        return min(int(iou * self.n_bins), self.n_bins - 1)
+
+    def update_image(self, pred_boxes, true_boxes) -> None:
+        """Add a single image worth of predictions and annotations."""
+        true_boxes = list(true_boxes)  # match_bboxes removes matched boxes in place
+        matches = match_bboxes(pred_boxes, true_boxes, id_map=self.id_map, **self.match_kwargs)
+
+        for class_id, iou, matched in matches:
+            self._grow(class_id)
+            if matched:
+                self.tp[class_id] += 1
+            else:
+                self.fp[class_id] += 1
+            self.iou_hist[class_id, self._bin(float(iou))] += 1
+            self.iou_sum[class_id] += float(iou)
+
+        for true_box in true_boxes:
+            class_id = int(true_box[4])
+            self._grow(class_id)
+            self.fn[class_id] += 1
+
+        self.n_images += 1
+
+    def update(self, pred_boxes_batch, true_boxes_batch) -> None:
+        """
+        Add a batch of images.
+
+        Args:
+            pred_boxes_batch (list): per-image predictions, e.g. detections.xyxy
+            true_boxes_batch (list): per-image annotations, e.g. from anns_per_category
+        """
+        for pred_boxes, true_boxes in zip(pred_boxes_batch, true_boxes_batch):
+            self.update_image(pred_boxes, true_boxes)
+
+    def merge(self, other: "EvaluationAccumulator") -> "EvaluationAccumulator":
+        """Add the state of another accumulator (e.g. from another worker) into this one."""
+        if other.n_bins != self.n_bins:
+            raise ValueError("Cannot merge accumulators with different IoU bins")
+
+        self._grow(other.num_classes - 1)
+        n = other.num_classes
+        self.tp[:n] += other.tp
+        self.fp[:n] += other.fp
+        self.fn[:n] += other.fn
+        self.iou_hist[:n] += other.iou_hist
+        self.iou_sum[:n] += other.iou_sum
+        self.n_images += other.n_images
+        return self
+
+    def __add__(self, other: "EvaluationAccumulator") -> "EvaluationAccumulator":
+        merged = EvaluationAccumulator(
+            num_classes=self.num_classes, 
+            n_bins=self.n_bins, 
+            id_map=self.id_map, 
+            **self.match_kwargs
+        )
+        return merged.merge(self).merge(other)
+
+    def confusion_metrics(self):
+        """Total tp, fp, fn over all classes."""
+        return int(self.tp.sum()), int(self.fp.sum()), int(self.fn.sum())
+
+    def precision_recall(self, eps=1e-6):
+        return calculate_precision_recall(*self.confusion_metrics(), eps=eps)
+
+    def per_class_precision_recall(self, eps=1e-6):
+        """Arrays of precision and recall indexed by class id."""
+        return calculate_precision_recall(self.tp, self.fp, self.fn, eps=eps)
+
+    def mean_iou(self) -> float:
+        n_preds = self.iou_hist.sum()
+        return float(self.iou_sum.sum() / n_preds) if n_preds else 0.0
+
+    def summary(self) -> dict:
+        precision, recall = self.precision_recall()
+        return {
+            "precision": precision,
+            "recall": recall,
+            "iou": self.mean_iou(),
+            "n_images": self.n_images,
+        }
+
+
+def evaluate_model_streaming(
+        category: str, 
+        data: COCO, 
+        model: YOLOv5Model, 
+        id_map: dict={}, 
+        verbose: bool=True,  
+        N: int=-1, 
+        batch_size: int=16,
+        accumulator: EvaluationAccumulator=None,
+        **kwargs
+    ):
+    """
+    Same as evaluate_model, but runs detection and evaluation batch by batch 
+    through an EvaluationAccumulator, so memory stays constant in the number of images.
+    Pass in an existing accumulator to keep adding to it (e.g. across categories).
+    """
+    configure_threads()
+    start = time()
+    if accumulator is None:
+        accumulator = EvaluationAccumulator(id_map=id_map, **kwargs)
+
+    for image_paths, anns in batches_per_category(
+            category=category, data=data, batch_size=batch_size, N=N, **kwargs
+        ):
+        with span("evaluation.detect"):
+            detections = model.forward(image_paths)
+        with span("evaluation.match"):
+            accumulator.update(detections.xyxy, anns)
+
+        if verbose > 1:
+            print(f"{accumulator.n_images} images:", accumulator.summary())
+
+    results = accumulator.summary()
+    if verbose:
+        print_precision_recall_iou(results["precision"], results["recall"], [results["iou"]])
+        if getattr(model, "postprocess", None):
+            print(model.postprocess.summary())
+
+    results["time"] = time() - start
+    return results
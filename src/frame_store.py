@@ -0,0 +1,184 @@
+"""
+Shared-memory frame arena for handing frames between worker processes without pickling them.
+
+The arena is a fixed number of equally sized slots in one shared memory block, plus a small
+shared table with each slot's reference count and frame shape (up to 3 dimensions). Producers allocate a slot,
+write (or decode) a frame straight into it and pass only the slot index through a queue;
+consumers get a NumPy view of the same memory. When every slot is in use, allocate() blocks
+until a consumer releases one, which gives backpressure for free.
+
+    arena = FrameArena(slots=16, slot_shape=(1080, 1920, 3))
+    out_arena = FrameArena(slots=8, slot_shape=(4 * 1080, 4 * 1920, 3))   # x4 SR outputs
+
+    # decoder process
+    slot = arena.allocate()
+    ok, _ = capture.read(arena.view(slot))   # cv2 decodes straight into shared memory
+    queue.put(slot)
+
+    # SR process
+    slot = queue.get()
+    out_slot = out_arena.allocate()
+    out_arena.write(out_slot, model.enhance(arena.view(slot))[0])
+    arena.release(slot)
+
+Arenas are picklable and can be passed to multiprocessing.Process / Pool initializers,
+the child side attaches to the same shared memory.
+"""
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import multiprocessing
+import numpy as np
+
+
+REFCOUNT, HEIGHT, WIDTH, CHANNELS, NDIM = range(5)
+META_COLUMNS = 5
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        # python >= 3.13, the creating process owns the memory
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class FrameArena:
+    """
+    Args:
+        slots (int): number of frames the arena holds
+        slot_shape (tuple): largest frame shape a slot can hold, smaller frames fit too
+        dtype: frame dtype
+        context: multiprocessing context used for the lock and semaphore
+    """
+
+    def __init__(self, slots: int, slot_shape: Tuple[int, ...], dtype=np.uint8, context=None):
+        context = context or multiprocessing.get_context()
+        self.slots = slots
+        self.slot_shape = tuple(slot_shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_size = int(np.prod(self.slot_shape))
+
+        self.data_shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_size * self.dtype.itemsize)
+        self.meta_shm = shared_memory.SharedMemory(create=True, size=slots * META_COLUMNS * 8)
+        self.lock = context.Lock()
+        self.free = context.Semaphore(slots)
+        self.owner = True
+        self._map()
+        self.meta[:] = 0
+
+    def _map(self):
+        self.data = np.ndarray((self.slots, self.slot_size), dtype=self.dtype, buffer=self.data_shm.buf)
+        self.meta = np.ndarray((self.slots, META_COLUMNS), dtype=np.int64, buffer=self.meta_shm.buf)
+
+    def __getstate__(self):
+        return {
+            "slots": self.slots,
+            "slot_shape": self.slot_shape,
+            "dtype": self.dtype,
+            "slot_size": self.slot_size,
+            "data_name": self.data_shm.name,
+            "meta_name": self.meta_shm.name,
+            "lock": self.lock,
+            "free": self.free,
+        }
+
+    def __setstate__(self, state):
+        self.slots = state["slots"]
+        self.slot_shape = state["slot_shape"]
+        self.dtype = state["dtype"]
+        self.slot_size = state["slot_size"]
+        self.data_shm = _attach(state["data_name"])
+        self.meta_shm = _attach(state["meta_name"])
+        self.lock = state["lock"]
+        self.free = state["free"]
+        self.owner = False
+        self._map()
+
+    # slot lifecycle
+    def allocate(self, timeout: float = None) -> int:
+        """
+        Reserve a free slot (reference count 1) and return its index.
+        Blocks while the arena is full, raises TimeoutError after timeout seconds.
+        """
+        if not self.free.acquire(timeout=timeout):
+            raise TimeoutError("No free slot in the frame arena")
+
+        with self.lock:
+            slot = int(np.flatnonzero(self.meta[:, REFCOUNT] == 0)[0])
+            self.meta[slot] = (1, *self._shape_meta(self.slot_shape))
+        return slot
+
+    def retain(self, slot: int) -> None:
+        """Add a reference, e.g. before handing the slot to a second consumer."""
+        with self.lock:
+            if self.meta[slot, REFCOUNT] <= 0:
+                raise ValueError(f"Slot {slot} is not allocated")
+            self.meta[slot, REFCOUNT] += 1
+
+    def release(self, slot: int) -> None:
+        """Drop a reference, the slot becomes free again once nobody holds it."""
+        with self.lock:
+            if self.meta[slot, REFCOUNT] <= 0:
+                raise ValueError(f"Slot {slot} is not allocated")
+            self.meta[slot, REFCOUNT] -= 1
+            freed = self.meta[slot, REFCOUNT] == 0
+        if freed:
+            self.free.release()
+
+    def refcount(self, slot: int) -> int:
+        return int(self.meta[slot, REFCOUNT])
+
+    # frame access
+    def _shape_meta(self, shape):
+        # (h, w, c) padded with ones, followed by the number of dimensions to restore the exact shape
+        if len(shape) > 3:
+            raise ValueError(f"Frames can have at most 3 dimensions, got shape {shape}")
+        return tuple(shape) + (1,) * (3 - len(shape)) + (len(shape),)
+
+    def shape(self, slot: int) -> Tuple[int, ...]:
+        h, w, c, ndim = self.meta[slot, HEIGHT:]
+        return tuple(int(d) for d in (h, w, c)[:ndim])
+
+    def view(self, slot: int, shape: Tuple[int, ...] = None) -> np.ndarray:
+        """
+        Zero-copy array over the slot's memory. Passing a shape records it for other processes,
+        without one the slot's recorded shape is used.
+        """
+        if shape is not None:
+            size = int(np.prod(shape))
+            if size > self.slot_size:
+                raise ValueError(f"Frame of shape {shape} does not fit in slots of shape {self.slot_shape}")
+            self.meta[slot, HEIGHT:] = self._shape_meta(shape)
+        else:
+            shape = self.shape(slot)
+            size = int(np.prod(shape))
+        return self.data[slot, :size].reshape(shape)
+
+    def write(self, slot: int, frame: np.ndarray) -> np.ndarray:
+        """Copy frame into the slot (the one copy needed when the producer can't write in place)."""
+        view = self.view(slot, frame.shape)
+        np.copyto(view, frame, casting="unsafe")
+        return view
+
+    def put(self, frame: np.ndarray, timeout: float = None) -> int:
+        """allocate + write, returns the slot index."""
+        slot = self.allocate(timeout=timeout)
+        self.write(slot, frame)
+        return slot
+
+    # cleanup
+    def close(self) -> None:
+        # views into the buffers must be gone before the memory can be closed
+        self.data = self.meta = None
+        self.data_shm.close()
+        self.meta_shm.close()
+        if self.owner:
+            self.data_shm.unlink()
+            self.meta_shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,194 @@
+"""
+Lightweight per-stage latency instrumentation.
+
+Wrap a stage in a named span and its wall-clock time is recorded in a histogram:
+
+    with span("sr.esrgan"):
+        img = upsampler.enhance(img)
+
+Spans are disabled unless INSTRUMENTATION=1 is set (or enable() is called),
+in which case span() hands back a shared no-op context manager, so leaving them
+in hot paths costs next to nothing.
+Recorded timings can be exported as JSON or as Prometheus-style text.
+"""
+from bisect import bisect_left
+from functools import wraps
+
+import json
+import os
+import threading
+import time
+
+
+ENABLED = os.environ.get("INSTRUMENTATION", "0") == "1"
+
+# histogram bucket upper bounds (seconds), log-spaced from 10us to 100s, 8 per decade
+BUCKETS = tuple(1e-5 * 10 ** (i / 8) for i in range(8 * 7 + 1))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Fixed-bucket histogram, quantiles are interpolated within buckets."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last bucket catches overflow
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            if cumulative + c >= rank and c:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (rank - cumulative) / c
+                return min(max(value, self.min), self.max)
+            cumulative += c
+        return self.max
+
+    def merge(self, other: "Histogram") -> "Histogram":
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            **{f"p{int(q * 100)}": self.quantile(q) for q in QUANTILES},
+        }
+
+
+class Registry:
+    """Thread-safe collection of named histograms."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.histograms = {}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {name: h.to_dict() for name, h in sorted(self.histograms.items())}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, metric: str = "pipeline_span_seconds") -> str:
+        lines = [
+            f"# HELP {metric} Wall-clock time spent in each pipeline stage.",
+            f"# TYPE {metric} summary",
+        ]
+        for name, stats in self.snapshot().items():
+            for q in QUANTILES:
+                lines.append(f'{metric}{{span="{name}",quantile="{q}"}} {stats[f"p{int(q * 100)}"]:.6g}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {stats["sum"]:.6g}')
+            lines.append(f'{metric}_count{{span="{name}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def enable(flag: bool = True) -> None:
+    global ENABLED
+    ENABLED = flag
+
+
+def span(name: str):
+    """Context manager timing the enclosed block under name."""
+    return _Span(name) if ENABLED else NULL_SPAN
+
+
+def timed(name: str = None):
+    """Decorator version of span, defaults to the function's qualified name."""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record an externally measured duration."""
+    if ENABLED:
+        REGISTRY.observe(name, seconds)
+
+
+def snapshot() -> dict:
+    return REGISTRY.snapshot()
+
+
+def to_json(**kwargs) -> str:
+    return REGISTRY.to_json(**kwargs)
+
+
+def to_prometheus(**kwargs) -> str:
+    return REGISTRY.to_prometheus(**kwargs)
+
+
+def reset() -> None:
+    REGISTRY.reset()
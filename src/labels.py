@@ -0,0 +1,122 @@
+"""
+Compiled Benthic -> TrashCAN label mapping.
+
+The json mappings in data/ are compiled once into integer NumPy lookup tables, so a whole
+batch of class ids is remapped with one indexing operation instead of a dict lookup per box:
+
+- lut: benthic class id -> TrashCAN id (ids without a mapping pass through unchanged)
+- many_mask: TrashCAN ids that the single "one" class may stand for (the trash case)
+- exclude_mask: TrashCAN ids left out of evaluation (plants, rov, ...)
+
+The same LabelMap is used by evaluation (evaluate_bboxes(label_map=...)), by the detector
+output (remap_detections) and by the video tracker (VideoTracker(label_map=...)).
+"""
+from typing import Dict, Iterable
+
+import json
+import numpy as np
+
+
+BENTHIC2TRASHCAN_IDS = "data/benthic2trashcan_ids.json"
+BENTHIC2TRASHCAN_NAMES = "data/benthic2trashcan.json"
+
+
+def _to_numpy(x) -> np.ndarray:
+    return x.cpu().numpy() if hasattr(x, "cpu") else np.asarray(x)
+
+
+def _mask(ids: Iterable[int], size: int) -> np.ndarray:
+    ids = [int(i) for i in ids]
+    mask = np.zeros(max([size, *[i + 1 for i in ids]]), dtype=bool)
+    mask[ids] = True
+    return mask
+
+
+class LabelMap:
+    """
+    Args:
+        id_map (dict): benthic class id -> TrashCAN class id
+        one_idx (int): TrashCAN id predicted for the one class that covers many_idx
+        many_idx (list): TrashCAN ids covered by one_idx
+        exclude_ids (list): TrashCAN ids to exclude from evaluation
+        names (dict): TrashCAN id -> name, for labelling remapped detections
+    """
+
+    def __init__(
+            self,
+            id_map: Dict[int, int],
+            one_idx: int = None,
+            many_idx: Iterable[int] = (),
+            exclude_ids: Iterable[int] = (),
+            names: Dict[int, str] = None,
+        ):
+        id_map = {int(k): int(v) for k, v in id_map.items()}
+        self.id_map = id_map
+        self.one_idx = -1 if one_idx is None else int(one_idx)
+        self.names = names or {}
+
+        self.lut = np.arange(max(id_map, default=-1) + 1, dtype=np.int64)
+        self.lut[list(id_map)] = list(id_map.values())
+
+        n_target = max([*id_map.values(), *many_idx, *exclude_ids, self.one_idx, -1]) + 1
+        self.many_mask = _mask(many_idx, n_target)
+        self.exclude_mask = _mask(exclude_ids, n_target)
+
+    @classmethod
+    def from_json(cls, path: str = BENTHIC2TRASHCAN_IDS, **kwargs) -> "LabelMap":
+        """From the string keyed id map, e.g. data/benthic2trashcan_ids.json."""
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
+
+    @classmethod
+    def from_taxonomy(
+            cls,
+            model_names: Dict[int, str],
+            group_ids: Dict[str, int],
+            path: str = BENTHIC2TRASHCAN_NAMES,
+            **kwargs
+        ) -> "LabelMap":
+        """
+        From the taxon name -> TrashCAN group mapping (data/benthic2trashcan.json).
+
+        Args:
+            model_names (dict): benthic class id -> taxon name, e.g. model.names
+            group_ids (dict): TrashCAN group name -> id, e.g. from the TrashCAN COCO categories
+        """
+        with open(path) as f:
+            taxon_to_group = json.load(f)
+
+        id_map = {
+            i: group_ids[taxon_to_group[name]]
+            for i, name in dict(model_names).items()
+            if taxon_to_group.get(name) in group_ids
+        }
+        names = {v: k for k, v in group_ids.items()}
+        return cls(id_map, names=kwargs.pop("names", names), **kwargs)
+
+    def remap(self, class_ids) -> np.ndarray:
+        """Vectorized id_map lookup, ids outside the table are returned unchanged."""
+        class_ids = _to_numpy(class_ids).astype(np.int64)
+        if not len(self.lut):
+            return class_ids
+        in_table = (class_ids >= 0) & (class_ids < len(self.lut))
+        return np.where(in_table, self.lut[np.where(in_table, class_ids, 0)], class_ids)
+
+    def remap_detections(self, boxes) -> np.ndarray:
+        """(N, 6) x1, y1, x2, y2, confidence, class_id boxes with remapped class ids."""
+        boxes = _to_numpy(boxes).astype(np.float64, copy=True).reshape(-1, 6)
+        boxes[:, 5] = self.remap(boxes[:, 5])
+        return boxes
+
+    def _lookup(self, mask: np.ndarray, class_ids: np.ndarray) -> np.ndarray:
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        if not len(mask):
+            return np.zeros(class_ids.shape, dtype=bool)
+        in_table = (class_ids >= 0) & (class_ids < len(mask))
+        return in_table & mask[np.where(in_table, class_ids, 0)]
+
+    def is_excluded(self, class_ids) -> np.ndarray:
+        return self._lookup(self.exclude_mask, class_ids)
+
+    def is_many(self, class_ids) -> np.ndarray:
+        return self._lookup(self.many_mask, class_ids)
@@ -0,0 +1,191 @@
+"""
+Post-processing of YOLOv5 detections before evaluation, rendering and tracking.
+
+In cluttered benthic scenes the detector returns many low confidence and overlapping boxes,
+and every one of them goes through the greedy box matching in evaluation.py and through
+Detections.save() rendering. PostProcessor prunes each image's (N, 6) xyxy tensor in three
+vectorized steps, and counts how many boxes every step removed:
+
+1. confidence floor: drop boxes below conf_threshold
+2. class-aware NMS: suppress boxes overlapping a higher scoring box of the same class
+3. top-k: keep the top_k highest scoring boxes per image
+
+yolov5's AutoShape runs its own confidence floor and class-aware NMS first (conf=0.25, iou=0.45,
+max_det=1000 by default), which would leave nothing for the NMS step to do. configure() sets
+AutoShape's floor to this stage's candidate_conf (conf_threshold unless given) and its IoU
+threshold to 1.0. torchvision only suppresses boxes with IoU strictly above the threshold, so
+AutoShape's NMS then drops nothing and the NMS and top-k counted here are the ones that prune.
+AutoShape still sees the same candidates as with its defaults, so upstream work does not grow;
+the confidence step only counts boxes when candidate_conf is set below conf_threshold.
+YOLOv5ModelWithUpsample(postprocess=...) calls configure() on its AutoShape.
+
+    model = YOLOv5ModelWithUpsample(..., postprocess=PostProcessor(conf_threshold=0.4, top_k=50))
+    detections = model.forward(image_paths)   # already pruned
+    model.postprocess.stats                   # {"input": ..., "confidence": ..., "nms": ..., "top_k": ..., "output": ...}
+"""
+from typing import Tuple
+
+import numpy as np
+import torch
+
+try:
+    from torchvision.ops import batched_nms
+except ImportError:
+    batched_nms = None
+
+try:
+    from src.instrumentation import span
+except ImportError:
+    from instrumentation import span
+
+
+STEPS = ["confidence", "nms", "top_k"]
+
+
+def box_iou(boxes1: torch.Tensor, boxes2: torch.Tensor) -> torch.Tensor:
+    """(N, M) IoU matrix between (N, 4) and (M, 4) xyxy boxes."""
+    area1 = (boxes1[:, 2] - boxes1[:, 0]).clamp(min=0) * (boxes1[:, 3] - boxes1[:, 1]).clamp(min=0)
+    area2 = (boxes2[:, 2] - boxes2[:, 0]).clamp(min=0) * (boxes2[:, 3] - boxes2[:, 1]).clamp(min=0)
+
+    top_left = torch.max(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = torch.min(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = (bottom_right - top_left).clamp(min=0).prod(dim=2)
+
+    return inter / (area1[:, None] + area2[None, :] - inter).clamp(min=1e-9)
+
+
+def nms(boxes: torch.Tensor, scores: torch.Tensor, class_ids: torch.Tensor, iou_threshold: float) -> torch.Tensor:
+    """
+    Class-aware NMS, returns the indices of the kept boxes by decreasing score.
+    Boxes are shifted by class_id * (max coordinate + 1) so boxes of different classes never overlap,
+    which turns per-class NMS into a single NMS call (the same trick as yolov5 / torchvision).
+    """
+    if batched_nms is not None:
+        return batched_nms(boxes.float(), scores.float(), class_ids, iou_threshold)
+
+    # torchvision missing: greedy NMS over one IoU matrix
+    order = scores.argsort(descending=True)
+    offset = class_ids[order, None].to(boxes.dtype) * (boxes.max() + 1)
+    shifted = boxes[order] + offset
+    suppresses = (box_iou(shifted, shifted) > iou_threshold).triu(diagonal=1).cpu().numpy()
+
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep &= ~suppresses[i]
+    return order[torch.from_numpy(keep).to(order.device)]
+
+
+class PostProcessor:
+    """
+    Args:
+        conf_threshold (float): confidence floor, boxes below it are dropped (None to skip)
+        iou_threshold (float): IoU above which NMS suppresses the lower scoring box (None to skip)
+        top_k (int): maximum number of boxes kept per image (None to skip)
+        class_aware (bool): only suppress boxes of the same class during NMS
+        candidate_conf (float): confidence floor left to AutoShape over the raw anchors,
+            defaults to conf_threshold, see configure
+        max_candidates (int): boxes per image AutoShape may pass on (its max_det), see configure
+    """
+
+    def __init__(
+            self,
+            conf_threshold: float = 0.25,
+            iou_threshold: float = 0.45,
+            top_k: int = 100,
+            class_aware: bool = True,
+            candidate_conf: float = None,
+            max_candidates: int = 1000,
+        ):
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.top_k = top_k
+        self.class_aware = class_aware
+        self.candidate_conf = candidate_conf
+        self.max_candidates = max_candidates
+        self.reset()
+
+    def configure(self, autoshape) -> None:
+        """
+        Take over NMS from a yolov5 AutoShape model (e.g. YOLOv5Model._model).
+        The confidence floor stays in AutoShape, it keeps NMS from running over every raw anchor.
+        """
+        floor = self.conf_threshold if self.candidate_conf is None else self.candidate_conf
+        if floor is not None:
+            autoshape.conf = floor
+        if self.iou_threshold is not None:
+            # only IoU > threshold is suppressed, so at 1.0 AutoShape's NMS keeps every box
+            autoshape.iou = 1.0
+            autoshape.agnostic = False
+        autoshape.max_det = self.max_candidates
+
+    def reset(self) -> None:
+        self.stats = {"images": 0, "input": 0, **{step: 0 for step in STEPS}, "output": 0}
+
+    def keep_indices(self, pred: torch.Tensor) -> Tuple[torch.Tensor, dict]:
+        """
+        Indices of the boxes of one image's (N, 6) x1, y1, x2, y2, confidence, class_id tensor
+        that survive all steps, and the number of boxes each step removed.
+        """
+        keep = torch.arange(len(pred), device=pred.device)
+        removed = {}
+
+        if self.conf_threshold is not None:
+            n = len(keep)
+            keep = keep[pred[keep, 4] >= self.conf_threshold]
+            removed["confidence"] = n - len(keep)
+
+        if self.iou_threshold is not None and len(keep) > 1:
+            n = len(keep)
+            boxes = pred[keep]
+            class_ids = boxes[:, 5].long() if self.class_aware else torch.zeros_like(keep)
+            keep = keep[nms(boxes[:, :4], boxes[:, 4], class_ids, self.iou_threshold)]
+            removed["nms"] = n - len(keep)
+
+        if self.top_k is not None and len(keep) > self.top_k:
+            n = len(keep)
+            keep = keep[pred[keep, 4].topk(self.top_k).indices]
+            removed["top_k"] = n - len(keep)
+
+        # keep yolov5's order, highest confidence first
+        keep = keep[pred[keep, 4].argsort(descending=True)]
+        return keep, {step: removed.get(step, 0) for step in STEPS}
+
+    def prune(self, pred: torch.Tensor) -> Tuple[torch.Tensor, dict]:
+        """Pruned copy of one image's (N, 6) boxes and the per-step removal counts."""
+        keep, removed = self.keep_indices(pred)
+        self._count(len(pred), removed, len(keep))
+        return pred[keep], removed
+
+    def __call__(self, detections):
+        """
+        Prune yolov5 Detections in place: pred/xyxy and the derived xywh, xyxyn and xywhn lists,
+        so evaluation, Detections.save() and supervision's from_yolov5 only see the kept boxes.
+        """
+        with span("postprocess"):
+            for i, pred in enumerate(detections.pred):
+                keep, removed = self.keep_indices(pred)
+                self._count(len(pred), removed, len(keep))
+
+                for attr in ["xywh", "xyxyn", "xywhn"]:
+                    if hasattr(detections, attr):
+                        getattr(detections, attr)[i] = getattr(detections, attr)[i][keep]
+                detections.pred[i] = pred[keep]
+
+            # xyxy is the same list as pred in yolov5, keep it that way if it was replaced
+            detections.xyxy = detections.pred
+        return detections
+
+    def _count(self, n_input: int, removed: dict, n_output: int) -> None:
+        self.stats["images"] += 1
+        self.stats["input"] += n_input
+        self.stats["output"] += n_output
+        for step in STEPS:
+            self.stats[step] += removed[step]
+
+    def summary(self) -> str:
+        stats = self.stats
+        return (
+            f"Post-processing kept {stats['output']}/{stats['input']} boxes over {stats['images']} images "
+            f"(removed {stats['confidence']} below confidence, {stats['nms']} by NMS, {stats['top_k']} by top-k)"
+        )
@@ -0,0 +1,208 @@
+"""
+Appearance based re-identification for DeepSORT-style tracking.
+
+All detection crops of a frame are embedded in a single batched forward pass
+(deep-sort-realtime's MobileNetV2 embedder), and each track keeps its most recent
+embeddings in a fixed-size ring buffer. Matching detections against the gallery
+is a single batched matrix product, so appearance cues stay affordable on CPU.
+"""
+from typing import List
+
+import numpy as np
+
+try:
+    from src.instrumentation import span
+    from src.tracker import INFEASIBLE, KalmanTracker
+except ImportError:
+    from instrumentation import span
+    from tracker import INFEASIBLE, KalmanTracker
+
+
+def crop_detections(frame: np.ndarray, xyxy: np.ndarray) -> List[np.ndarray]:
+    """Crop every box out of frame, clipped to the frame and at least one pixel large."""
+    h, w = frame.shape[:2]
+    boxes = np.asarray(xyxy).reshape(-1, 4).round().astype(int)
+    x1 = np.clip(boxes[:, 0], 0, w - 1)
+    y1 = np.clip(boxes[:, 1], 0, h - 1)
+    x2 = np.maximum(np.clip(boxes[:, 2], 0, w), x1 + 1)
+    y2 = np.maximum(np.clip(boxes[:, 3], 0, h), y1 + 1)
+    return [frame[b:d, a:c] for a, b, c, d in zip(x1, y1, x2, y2)]
+
+
+class AppearanceEmbedder:
+    """
+    Batched appearance embeddings for detection crops.
+
+    Args:
+        embedder: object with predict(list of crops) -> list of features,
+            defaults to deep-sort-realtime's MobileNetv2_Embedder
+        max_batch_size (int): crops per forward pass, keep above the typical detections per frame
+        half (bool): half precision (GPU only)
+        gpu (bool): run the embedder on GPU
+        bgr (bool): crops are BGR (cv2 decoded frames)
+    """
+
+    def __init__(self, embedder=None, max_batch_size: int = 64, half: bool = False, gpu: bool = False, bgr: bool = True):
+        if embedder is None:
+            from deep_sort_realtime.embedder.embedder_pytorch import MobileNetv2_Embedder
+            embedder = MobileNetv2_Embedder(half=half, max_batch_size=max_batch_size, bgr=bgr, gpu=gpu)
+        self.embedder = embedder
+
+    def embed(self, frame: np.ndarray, xyxy: np.ndarray) -> np.ndarray:
+        """L2-normalized (D, F) embeddings for the D boxes in frame."""
+        crops = crop_detections(frame, xyxy)
+        if not crops:
+            return None
+
+        with span("reid.embed"):
+            features = np.asarray(self.embedder.predict(crops), dtype=np.float32)
+        return features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+
+
+class EmbeddingGallery:
+    """
+    Fixed-size store of the last budget embeddings per track.
+    Memory is max_tracks * budget * dim floats, allocated on the first add.
+
+    Args:
+        budget (int): embeddings kept per track (ring buffer)
+        max_tracks (int): track slots, the least recently updated track is evicted when full
+    """
+
+    def __init__(self, budget: int = 32, max_tracks: int = 1024):
+        self.budget = budget
+        self.max_tracks = max_tracks
+        self.features = None
+        self.count = np.zeros(max_tracks, dtype=np.int64)
+        self.cursor = np.zeros(max_tracks, dtype=np.int64)
+        self.last_update = np.zeros(max_tracks, dtype=np.int64)
+        self.slots = {}  # track id -> row in features
+        self.free = list(range(max_tracks - 1, -1, -1))
+        self.step = 0
+
+    def _slot(self, track_id: int) -> int:
+        if track_id in self.slots:
+            return self.slots[track_id]
+
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = int(np.argmin(self.last_update))
+            evicted = next(t for t, r in self.slots.items() if r == row)
+            del self.slots[evicted]
+
+        self.slots[track_id] = row
+        self.count[row] = 0
+        self.cursor[row] = 0
+        return row
+
+    def add(self, track_ids: np.ndarray, features: np.ndarray) -> None:
+        if not len(track_ids):
+            return
+        if self.features is None:
+            self.features = np.zeros((self.max_tracks, self.budget, features.shape[1]), dtype=np.float32)
+
+        self.step += 1
+        rows = np.array([self._slot(int(t)) for t in track_ids])
+        self.features[rows, self.cursor[rows]] = features
+        self.cursor[rows] = (self.cursor[rows] + 1) % self.budget
+        self.count[rows] = np.minimum(self.count[rows] + 1, self.budget)
+        self.last_update[rows] = self.step
+
+    def distance(self, track_ids: np.ndarray, features: np.ndarray) -> np.ndarray:
+        """
+        Smallest cosine distance between each track's gallery (rows) and each detection (cols).
+        Tracks without any stored embedding get inf.
+        """
+        distance = np.full((len(track_ids), len(features)), np.inf)
+        if self.features is None or not len(features):
+            return distance
+
+        rows = np.array([self.slots.get(int(t), -1) for t in track_ids], dtype=np.int64)
+        known = rows >= 0
+        if not known.any():
+            return distance
+
+        rows = rows[known]
+        similarity = self.features[rows] @ features.T  # (T, budget, D)
+        valid = np.arange(self.budget)[None, :] < self.count[rows][:, None]
+        similarity[~valid] = -np.inf
+        distance[known] = 1 - similarity.max(axis=1)
+        return distance
+
+    def prune(self, active_ids: np.ndarray) -> None:
+        """Free the slots of tracks that no longer exist."""
+        active = set(int(t) for t in active_ids)
+        for track_id in [t for t in self.slots if t not in active]:
+            self.free.append(self.slots.pop(track_id))
+
+
+class AppearanceTracker(KalmanTracker):
+    """
+    KalmanTracker whose assignment cost mixes IoU with appearance distance to each track's gallery.
+
+    Args:
+        embedder (AppearanceEmbedder): used by update_with_detections to embed the frame's crops
+        appearance_weight (float): weight of the cosine distance in the cost, the rest is 1 - IoU
+        max_cosine_distance (float): detections further than this from a track's gallery can't match it
+        budget (int): embeddings kept per track
+        max_tracks (int): gallery track slots
+        **kwargs: passed to KalmanTracker
+    """
+
+    needs_frame = True
+
+    def __init__(
+            self,
+            embedder: AppearanceEmbedder = None,
+            appearance_weight: float = 0.5,
+            max_cosine_distance: float = 0.3,
+            budget: int = 32,
+            max_tracks: int = 1024,
+            **kwargs
+        ):
+        super().__init__(**kwargs)
+        self.embedder = embedder
+        self.appearance_weight = appearance_weight
+        self.max_cosine_distance = max_cosine_distance
+        self.gallery = EmbeddingGallery(budget=budget, max_tracks=max_tracks)
+        self.features = None
+
+    def cost_matrix(self, xyxy: np.ndarray, xyah: np.ndarray, class_id: np.ndarray) -> np.ndarray:
+        cost = super().cost_matrix(xyxy, xyah, class_id)
+        if self.features is None:
+            return cost
+
+        with span("reid.match"):
+            appearance = self.gallery.distance(self.ids, self.features)
+        known = np.isfinite(appearance)
+
+        combined = np.where(
+            known,
+            self.appearance_weight * appearance + (1 - self.appearance_weight) * cost,
+            cost
+        )
+        combined[(known & (appearance > self.max_cosine_distance)) | (cost >= INFEASIBLE)] = INFEASIBLE
+        return combined
+
+    def update(self, xyxy, confidence=None, class_id=None, features: np.ndarray = None):
+        self.features = features
+        det_idx, track_ids = super().update(xyxy, confidence, class_id)
+
+        if features is not None:
+            # embed every matched detection, tentative tracks need an appearance history before confirmation
+            all_det_idx, all_track_ids = self.matches
+            self.gallery.add(all_track_ids, features[all_det_idx])
+        self.gallery.prune(self.ids)
+        self.features = None
+        return det_idx, track_ids
+
+    def update_with_detections(self, detections, frame: np.ndarray = None):
+        features = None
+        if frame is not None and self.embedder is not None and len(detections):
+            features = self.embedder.embed(frame, detections.xyxy)
+
+        det_idx, track_ids = self.update(detections.xyxy, detections.confidence, detections.class_id, features)
+        tracked = detections[det_idx]
+        tracked.tracker_id = track_ids
+        return tracked
@@ -0,0 +1,162 @@
+"""
+CPU thread budget shared by torch (ESRGAN/YOLOv5), onnxruntime (ABPN) and OpenCV.
+
+Each of these libraries sizes its own thread pool to the whole machine by default,
+which oversubscribes the CPU as soon as several workers run on one node. The budget
+splits the node's cores between worker processes and per-library intra-op threads:
+
+    WORKERS=4 python src/app.py            # each worker gets cores // 4 threads
+    INTRA_OP_THREADS=2 python src/app.py   # or set the per-worker threads directly
+
+configure_threads() applies the split once per process. onnx_session_options() hands
+the same numbers to onnxruntime sessions. autotune() benchmarks the possible splits
+on the current machine:
+
+    python -m src.runtime --autotune
+"""
+from time import perf_counter
+
+import multiprocessing
+import os
+
+
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+BUDGET = None  # set by configure_threads
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def plan_threads(workers: int = None, intra_op: int = None, cores: int = None) -> dict:
+    """
+    Split cores between worker processes and intra-op threads per worker.
+    Unset values come from the WORKERS / INTRA_OP_THREADS env vars, then from the core count.
+    """
+    cores = cores or int(os.environ.get("CPU_CORES", available_cores()))
+    workers = workers or int(os.environ.get("WORKERS", 1))
+    intra_op = intra_op or int(os.environ.get("INTRA_OP_THREADS", 0)) or max(1, cores // workers)
+    return {
+        "cores": cores,
+        "workers": workers,
+        "intra_op": intra_op,
+        "inter_op": 1,
+    }
+
+
+def configure_threads(workers: int = None, intra_op: int = None, force: bool = False) -> dict:
+    """
+    Apply the thread budget to torch, OpenCV and the BLAS/OpenMP env vars of this process.
+    Only the first call has an effect unless force is set.
+    """
+    global BUDGET
+    if BUDGET is not None and not force:
+        return BUDGET
+
+    BUDGET = plan_threads(workers, intra_op)
+    threads = BUDGET["intra_op"]
+
+    # only picked up by libraries that haven't started their pools yet, so set them early
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(BUDGET["inter_op"])
+        except RuntimeError:
+            pass  # can only be set before torch runs any parallel work
+    except ImportError:
+        pass
+
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+
+    return BUDGET
+
+
+def onnx_session_options():
+    """onnxruntime.SessionOptions following the thread budget."""
+    import onnxruntime
+
+    budget = configure_threads()
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = budget["intra_op"]
+    options.inter_op_num_threads = budget["inter_op"]
+    return options
+
+
+# auto-tuning
+def default_workload(n: int = 4):
+    """Small conv stack on a synthetic frame, standing in for SR/detection inference."""
+    import torch
+
+    model = torch.nn.Sequential(*[torch.nn.Conv2d(32 if i else 3, 32, 3, padding=1) for i in range(4)]).eval()
+    x = torch.rand(1, 3, 256, 256)
+    with torch.no_grad():
+        for _ in range(n):
+            model(x)
+
+
+def _init_worker(intra_op):
+    configure_threads(intra_op=intra_op)
+
+
+def _run(fn):
+    fn()
+
+
+def autotune(fn=default_workload, cores: int = None, jobs_per_worker: int = 4, candidates: list = None) -> dict:
+    """
+    Time fn under every (workers, intra_op) split with workers * intra_op == cores
+    (or the given candidates), running jobs_per_worker calls per worker in a process pool.
+    fn has to be picklable (a module level function).
+
+    Returns the best split and the throughput (calls/s) of every split tried.
+    """
+    cores = cores or available_cores()
+    candidates = candidates or [(w, cores // w) for w in range(1, cores + 1) if cores % w == 0]
+
+    results = []
+    for workers, intra_op in candidates:
+        with multiprocessing.get_context("spawn").Pool(workers, _init_worker, (intra_op,)) as pool:
+            pool.map(_run, [fn] * workers)  # warm up every worker
+            start = perf_counter()
+            pool.map(_run, [fn] * (workers * jobs_per_worker))
+            elapsed = perf_counter() - start
+
+        throughput = workers * jobs_per_worker / elapsed
+        print(f"workers={workers:3d} intra_op={intra_op:3d}: {throughput:.2f} calls/s")
+        results.append({"workers": workers, "intra_op": intra_op, "throughput": throughput})
+
+    best = max(results, key=lambda r: r["throughput"])
+    return {"best": best, "results": results}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--autotune", action="store_true", help="benchmark all worker/thread splits")
+    parser.add_argument("--cores", type=int, default=None)
+    parser.add_argument("--output", type=str, default=None, help="save autotune results as JSON")
+    args = parser.parse_args()
+
+    if args.autotune:
+        report = autotune(cores=args.cores)
+        best = report["best"]
+        print(f"Best split: WORKERS={best['workers']} INTRA_OP_THREADS={best['intra_op']}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    else:
+        print(plan_threads(cores=args.cores))
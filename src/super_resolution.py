@@ -10,6 +10,19 @@ import onnxruntime
 import os
 import torch 
 
+try:
+    from src.artifacts import CompiledModule
+    from src.instrumentation import span
+    from src.postprocess import PostProcessor
+    from src.runtime import configure_threads, onnx_session_options
+    from src.weights import load_weights
+except ImportError:
+    from artifacts import CompiledModule
+    from instrumentation import span
+    from postprocess import PostProcessor
+    from runtime import configure_threads, onnx_session_options
+    from weights import load_weights
+
 # ABPN imports 
 from tqdm.auto import tqdm
 
@@ -18,6 +31,28 @@ from basicsr.archs.rrdbnet_arch import RRDBNet
 from realesrgan import RealESRGANer
 # import basicsr.data.degradations  # comment out line 8
 
+
+class MmapRealESRGANer(RealESRGANer):
+    """
+    RealESRGANer taking its weights from a memory-mapped state dict (see weights.py)
+    instead of unpickling the checkpoint into fresh memory. Same attributes as RealESRGANer.
+    """
+
+    def __init__(self, scale, model_path, model, tile=0, tile_pad=10, pre_pad=10, half=False, device=None):
+        self.scale = scale
+        self.tile_size = tile
+        self.tile_pad = tile_pad
+        self.pre_pad = pre_pad
+        self.mod_scale = None
+        self.half = half
+
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if device is None else device
+        load_weights(model, model_path)
+        model.eval()
+        self.model = model.to(self.device)
+        if self.half:
+            self.model = self.model.half()
+
 # # HAT imports (installed via scripts/get_hat.sh)
 # from hat.archs.hat_arch import HAT
 
@@ -31,6 +66,7 @@ class ABPN(torch.nn.Module):
         self.model_path = model_path
         self.saved_imgs = {}
         self.store = store
+        self.ort_session = None
 
     def pre_process(self, img: np.array) -> np.array:
         # H, W, C -> C, H, W
@@ -55,11 +91,16 @@ class ABPN(torch.nn.Module):
 
 
     def inference(self, img_array: np.array) -> np.array:
-        print("Inference", self.model_path)
         # unasure about ability to train an onnx model from a Mac
-        ort_session = onnxruntime.InferenceSession(self.model_path)
-        ort_inputs = {ort_session.get_inputs()[0].name: img_array}
-        ort_outs = ort_session.run(None, ort_inputs)
+        if self.ort_session is None:
+            print("Loading", self.model_path)
+            # threads follow the process-wide budget instead of grabbing every core
+            self.ort_session = onnxruntime.InferenceSession(
+                self.model_path, sess_options=onnx_session_options()
+            )
+        ort_inputs = {self.ort_session.get_inputs()[0].name: img_array}
+        with span("sr.abpn"):
+            ort_outs = self.ort_session.run(None, ort_inputs)
 
         return ort_outs[0]
 
@@ -69,7 +110,8 @@ class ABPN(torch.nn.Module):
 
         for image_path in tqdm(image_paths):
 
-            img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+            with span("decode"):
+                img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
             # filename = os.path.basename(image_path)
 
             if img.ndim == 2:
@@ -128,7 +170,7 @@ class ABPN(torch.nn.Module):
             )  # BGR
             # self.save(image_output, Path(image_path).stem)
         
-        return img, "BGR"
+        return image_output.astype('uint8'), "BGR"
 
 
 class ESRGAN(torch.nn.Module):
@@ -140,9 +182,12 @@ class ESRGAN(torch.nn.Module):
         tile_pad=10, 
         pre_pad=0, 
         half=False, 
-        device=None
+        device=None,
+        compile_format=None,
+        mmap_weights=False,
     ):
         super(ESRGAN, self).__init__()
+        configure_threads()
         # model path and name
         self.model_dir = model_dir
         self.model_path  = os.path.join(model_dir, model_name + '.pth') 
@@ -160,7 +205,7 @@ class ESRGAN(torch.nn.Module):
         self.half = half
 
         # acutal sr module
-        self.upsampler = RealESRGANer(
+        self.upsampler = (MmapRealESRGANer if mmap_weights else RealESRGANer)(
             scale=self.netscale,
             model_path=self.model_path,
             model=self.model,
@@ -176,13 +221,20 @@ class ESRGAN(torch.nn.Module):
             self.upsampler.device = torch.device(device)
             self.upsampler.model = self.upsampler.model.to(torch.device(device))
 
+        # optionally run RRDBNet from a cached TorchScript/ONNX artifact (see artifacts.py)
+        if compile_format:
+            self.upsampler.model = CompiledModule(
+                self.upsampler.model, f"esrgan-{model_name}", self.model_path, fmt=compile_format
+            )
+
 
     def upsample(self, image_paths: List[str]):
         outputs = []
 
         for image_path in tqdm(image_paths):
-            img = Image.open(image_path)
-            img = np.array(img)
+            with span("decode"):
+                img = Image.open(image_path)
+                img = np.array(img)
             img = self.enhance(img)[0]  # 2nd dim not needed, specifies output type 'RGB
             outputs += [img]
 
@@ -190,7 +242,8 @@ class ESRGAN(torch.nn.Module):
     
 
     def enhance(self, img: np.array) -> np.array:
-        return self.upsampler.enhance(img)
+        with span("sr.esrgan"):
+            return self.upsampler.enhance(img)
 
 
     def check_model_present(self):
@@ -341,8 +394,24 @@ class YOLOv5ModelWithUpsample(YOLOv5Model, torch.nn.Module):
             detection_model_path: str = "/models/fathomnet_benthic/mbari-mb-benthic-33k.pt",  
             upsample_model: Union[ABPN, ESRGAN, Hat, None] = None,
             upsample_model_name: str = "",
+            compile_format: str = None,
+            mmap_weights: bool = False,
+            postprocess: PostProcessor = None,
         ):
+        configure_threads()
         super().__init__(detection_model_path)
+        self.postprocess = postprocess
+        if postprocess:
+            # AutoShape's own floor and NMS would otherwise run first and leave nothing to prune
+            postprocess.configure(self._model)
+
+        if mmap_weights:
+            # the hub loader still unpickles the checkpoint, but the weights we keep are shared pages.
+            # it also fuses Conv + BN, so the mapped file is made from the loaded network, not the checkpoint
+            load_weights(self._model.model.model, detection_model_path, from_module=True)
+
+        if compile_format:
+            self.compile_detector(detection_model_path, compile_format)
 
         self.upsample_model = None
         if upsample_model:
@@ -353,7 +422,9 @@ class YOLOv5ModelWithUpsample(YOLOv5Model, torch.nn.Module):
             elif upsample_model_name == "ESRGAN":
                 self.upsample_model = ESRGAN(
                     model_dir="../models/ESRGAN/",
-                    model_name="RealESRGAN_x4plus"
+                    model_name="RealESRGAN_x4plus",
+                    compile_format=compile_format,
+                    mmap_weights=mmap_weights,
                 )
             elif upsample_model_name == "HAT":
                 self.upsample_model = Hat()
@@ -363,6 +434,42 @@ class YOLOv5ModelWithUpsample(YOLOv5Model, torch.nn.Module):
     def forward(self, X: List[str]):
         if self.upsample_model:
             print("Upsampling images...")
-            X = self.upsample_model.upsample(X)
-        return self._model(X)
+            with span("sr"):
+                X = self.upsample_model.upsample(X)
+        with span("detection"):
+            detections = self._model(X)
+        return self.postprocess(detections) if self.postprocess else detections
+
+    def compile_detector(self, weights_path: str, compile_format: str = "torchscript", cache_dir: str = None):
+        """
+        Swap the detection network for cached TorchScript/ONNX artifacts (one per letterboxed input shape).
+        Only the network inside yolov5's AutoShape -> DetectMultiBackend is replaced, 
+        so letterboxing, NMS and the Detections results stay the same.
+        """
+        backend = self._model.model
+        backend.model = CompiledModule(
+            backend.model, "yolov5-benthic", weights_path, fmt=compile_format, cache_dir=cache_dir
+        )
+
+    @property
+    def names(self):
+        return self._model.names
+
+    def forward_frames(self, frames: List[np.ndarray]):
+        """
+        Same as forward, but for in-memory BGR frames (e.g. decoded video).
+        Returns the detections and the scale factor between output and input frames.
+        """
+        scale = 1
+        if self.upsample_model:
+            with span("sr"):
+                upsampled = [self.upsample_model.enhance(frame)[0] for frame in frames]
+            scale = upsampled[0].shape[1] / frames[0].shape[1]
+            frames = upsampled
+
+        # yolov5 expects RGB arrays
+        frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+        with span("detection"):
+            detections = self._model(frames)
+        return (self.postprocess(detections) if self.postprocess else detections), scale
     
\ No newline at end of file
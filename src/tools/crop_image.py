@@ -1,28 +1,28 @@
-from PIL import Image
+from PIL import Image, ImageSequence
 
-def crop_gif(input_file, output_file, x1, y1, x2, y2):
-    # Open the GIF file
-    gif = Image.open(input_file)
+from img2vid import write_gif
 
-    # Extract each frame of the GIF
-    frames = []
-    for frame in range(0, gif.n_frames):
-        gif.seek(frame)
-        frames.append(gif.copy())
 
-    # Crop each frame
-    cropped_frames = []
-    for frame in frames:
-        cropped_frame = frame.crop((x1, y1, x2, y2))
-        cropped_frames.append(cropped_frame)
-  
-    # Trim frames
-    final_frames = cropped_frames[:65]
+def crop_gif(input_file, output_file, x1, y1, x2, y2, max_frames=65, **kwargs):
+    """
+    Crop (and trim to max_frames) a GIF, streaming frames straight into the new GIF.
+    For cropping a video, use img2vid.vid2gif with crop=(x1, y1, x2, y2) instead, to do it in one pass.
+    """
+    # Open the GIF file
+    gif = Image.open(input_file)
+    duration = gif.info.get("duration", 100)
 
+    # Crop each frame as it is decoded, and trim frames
+    frames = (
+        frame.convert("RGB").crop((x1, y1, x2, y2))
+        for i, frame in zip(range(max_frames), ImageSequence.Iterator(gif))
+    )
 
     # Save the cropped frames as a new GIF
-    final_frames[0].save(output_file, save_all=True, append_images=final_frames[1:], loop=0)
+    write_gif(frames, output_file, duration=duration, **kwargs)
+
 
-# Replace 'input.gif', 'output_cropped.gif' with your file names
-# Replace x1, y1, x2, y2 with the coordinates of the top-left and bottom-right corners of the crop region
-crop_gif('img/mot/sea_feather_mot.gif', 'data/example/sea_feather_mot_cropped.gif', x1=560, y1=125, x2=1385, y2=950)
\ No newline at end of file
+if __name__ == "__main__":
+    # Replace 'input.gif', 'output_cropped.gif' with your file names
+    # Replace x1, y1, x2, y2 with the coordinates of the top-left and bottom-right corners of the crop region
+    crop_gif('img/mot/sea_feather_mot.gif', 'data/example/sea_feather_mot_cropped.gif', x1=560, y1=125, x2=1385, y2=950)
@@ -1,3 +1,6 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import sys
 import os
@@ -7,48 +10,290 @@ INPUT_DIR = os.environ.get("INPUT_DIR", ".")
 OUTPUT_DIR = os.environ.get("OUTPUT_DIR", ".")
 
 
-def convert(img_dir, output_name="output.mp4", img_prefix="", img_suffix=".jpg", fps=5):
-    img_array = []
-    img_dir_full_path = os.path.join(INPUT_DIR, img_dir)
-    print(f'Frame directory: {img_dir_full_path}/')
-    for filename in sorted(os.listdir(img_dir_full_path)):
-        if not filename.endswith(img_suffix):
-            continue
+def list_frames(img_dir_full_path, img_prefix="", img_suffix=".jpg"):
+    return [
+        os.path.join(img_dir_full_path, filename)
+        for filename in sorted(os.listdir(img_dir_full_path))
+        if filename.endswith(img_suffix) and filename.startswith(img_prefix)
+    ]
+
+
+def convert_files(paths, output_path, fps=5, workers=4, prefetch=8, on_size_mismatch="resize"):
+    """
+    Stream image files into a video.
+    Frames are decoded ahead on a thread pool but written in order as soon as they are ready,
+    so at most prefetch decoded frames are held in memory.
+    The first readable frame sets the video size, later frames of a different size are
+    resized ("resize"), dropped ("skip") or raise a ValueError ("error").
+
+    Returns the output path, or None if no frame could be read.
+    """
+    out = None
+    size = None
+    written = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        paths = iter(paths)
 
-        if not filename.startswith(img_prefix):
-            continue
+        def submit_next():
+            path = next(paths, None)
+            if path is not None:
+                pending.append((path, pool.submit(cv2.imread, str(path))))
 
-        print(f'Processing {filename}')
-        img = cv2.imread(os.path.join(img_dir_full_path, filename))
+        for _ in range(prefetch):
+            submit_next()
 
-        height, width, layers = img.shape
-        size = (width, height)
-        img_array.append(img)
+        while pending:
+            path, future = pending.popleft()
+            img = future.result()
+            submit_next()
+
+            print(f'Processing {os.path.basename(path)}')
+            if img is None:
+                print(f"Could not read {path}, skipping")
+                continue
+
+            height, width = img.shape[:2]
+            if size is None:
+                size = (width, height)
+                out = cv2.VideoWriter(
+                    filename=str(output_path), 
+                    fourcc=cv2.VideoWriter_fourcc(*"MP4V"), 
+                    fps=int(fps), 
+                    frameSize=size
+                )
+            elif (width, height) != size:
+                if on_size_mismatch == "resize":
+                    img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+                elif on_size_mismatch == "skip":
+                    print(f"Skipping {path}: size {(width, height)} does not match {size}")
+                    continue
+                else:
+                    raise ValueError(f"Frame {path} has size {(width, height)}, expected {size}")
+
+            out.write(img)
+            written += 1
+
+    if out is None:
+        return None
+
+    out.release()
+    print(f"Wrote {written} frames to {output_path}")
+    return output_path
 
-    if len(img_array) == 0:
+
+def convert(img_dir, output_name="output.mp4", img_prefix="", img_suffix=".jpg", fps=5, **kwargs):
+    img_dir_full_path = os.path.join(INPUT_DIR, img_dir)
+    print(f'Frame directory: {img_dir_full_path}/')
+    paths = list_frames(img_dir_full_path, img_prefix, img_suffix)
+
+    output_path = convert_files(paths, os.path.join(OUTPUT_DIR, output_name), fps=fps, **kwargs)
+    if output_path is None:
         print(f"No images found in {img_dir_full_path}")
         print(os.listdir(img_dir_full_path))
-        return
-    
-    out = cv2.VideoWriter(
-        filename=str(os.path.join(OUTPUT_DIR, output_name)), 
-        fourcc=cv2.VideoWriter_fourcc(*"MP4V"), 
-        fps=int(fps), 
-        frameSize=size
-    )
+    return output_path
 
-    for i in range(len(img_array)):
-        out.write(img_array[i])
 
-    out.release()
+class GifWriter:
+    """
+    Incremental GIF writer: the header goes out with the first frame and every
+    following frame is encoded and written straight away, so nothing is buffered.
+    Frames must be palette ("P") images of the same size. With a shared global
+    palette, frames carry no local color table.
+    """
+
+    def __init__(self, gif_path, duration=100, loop=0, global_palette=True):
+        self.gif_path = gif_path
+        self.duration = duration
+        self.loop = loop
+        self.global_palette = global_palette
+        self.fp = None
+        self.n_frames = 0
+
+    def write(self, frame):
+        from PIL import GifImagePlugin
+
+        if self.fp is None:
+            self.fp = open(self.gif_path, "wb")
+            header, _ = GifImagePlugin.getheader(frame, info={"loop": self.loop, "duration": self.duration})
+            for chunk in header:
+                self.fp.write(chunk)
+
+        for chunk in GifImagePlugin.getdata(
+                frame, 
+                duration=self.duration, 
+                include_color_table=not self.global_palette
+            ):
+            self.fp.write(chunk)
+        self.n_frames += 1
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.write(b";")  # trailer
+            self.fp.close()
 
+    def __enter__(self):
+        return self
 
-def vid2gif(video_path, gif_path):
-    """Convert a video to a gif."""
-    import moviepy.editor as mp  # TODO move to global scope
+    def __exit__(self, *exc):
+        self.close()
 
-    clip = mp.VideoFileClip(video_path)
-    clip.write_gif(gif_path)
+
+def _to_image(frame):
+    from PIL import Image
+    return frame if isinstance(frame, Image.Image) else Image.fromarray(frame)
+
+
+def sample_palette(frames, colors=256, width=160):
+    """
+    Palette ("P") image quantized from a stack of thumbnails of frames,
+    so the palette covers colors from across the whole clip, not just one frame.
+    """
+    from PIL import Image
+
+    thumbs = []
+    for frame in frames:
+        frame = _to_image(frame).convert("RGB")
+        height = max(1, round(frame.height * width / frame.width))
+        thumbs.append(frame.resize((width, height), Image.BILINEAR))
+
+    stacked = Image.new("RGB", (width, sum(t.height for t in thumbs)))
+    top = 0
+    for thumb in thumbs:
+        stacked.paste(thumb, (0, top))
+        top += thumb.height
+    return stacked.quantize(colors=colors)
+
+
+def write_gif(
+        frames, 
+        gif_path, 
+        duration=100, 
+        global_palette=False, 
+        palette_sample=None, 
+        colors=256, 
+        workers=4, 
+        prefetch=8, 
+        loop=0
+    ):
+    """
+    Quantize RGB frames (arrays or PIL images) on a thread pool and write them to a GIF in order.
+    By default every frame gets its own palette. With global_palette, one palette is shared by every
+    frame (smaller file, no color flicker), built from palette_sample (e.g. every Nth frame of the clip)
+    or from the first frame only if no sample is given. Frames are mapped onto it without dithering,
+    so colors missing from the sample show up as banding.
+
+    Returns the number of frames written.
+    """
+    from PIL import Image
+
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        return 0
+
+    first = _to_image(first).convert("RGB")
+    palette = None
+    if global_palette:
+        palette = sample_palette(palette_sample if palette_sample is not None else [first], colors=colors)
+
+    def quantize(frame):
+        frame = _to_image(frame).convert("RGB")
+        if palette is not None:
+            return frame.quantize(palette=palette, dither=Image.Dither.NONE)
+        return frame.quantize(colors=colors)
+
+    with GifWriter(gif_path, duration=duration, loop=loop, global_palette=global_palette) as writer, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        writer.write(quantize(first))
+
+        pending = deque()
+        for frame in frames:
+            pending.append(pool.submit(quantize, frame))
+            if len(pending) >= prefetch:
+                writer.write(pending.popleft().result())
+        while pending:
+            writer.write(pending.popleft().result())
+
+    return writer.n_frames
+
+
+def video_frames(video_path, crop=None, start=0, end=None, step=1):
+    """
+    Yield RGB frames of a video, trimmed to [start, end) frame indices, keeping every step-th frame
+    and cropped to crop=(x1, y1, x2, y2). Skipped frames are only grab()bed, not retrieved: with OpenCV's
+    FFmpeg backend they are still decoded, but the copy out and the color conversions are skipped.
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        index = 0
+        while end is None or index < end:
+            keep = index >= start and (index - start) % step == 0
+            if not keep:
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if crop:
+                x1, y1, x2, y2 = crop
+                frame = frame[y1:y2, x1:x2]
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+    finally:
+        cap.release()
+
+
+def seek_frames(video_path, indices, crop=None):
+    """
+    Yield RGB frames at the given frame indices by seeking to each one,
+    instead of reading the whole video up to the last index.
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        for index in indices:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if crop:
+                x1, y1, x2, y2 = crop
+                frame = frame[y1:y2, x1:x2]
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        cap.release()
+
+
+def vid2gif(video_path, gif_path, crop=None, start=0, end=None, step=1, fps=None, palette_frames=16, **kwargs):
+    """
+    Convert a video to a gif in a single streaming pass.
+    crop, start, end and step are applied while decoding, see video_frames. 
+    fps defaults to the video's own rate divided by step.
+    With global_palette=True, the shared palette is sampled from palette_frames frames spread over the clip,
+    read by seeking and shrunk to thumbnails one at a time (see sample_palette).
+    Other kwargs go to write_gif (global_palette, colors, workers, ...).
+    """
+    cap = cv2.VideoCapture(str(video_path))
+    fps = fps or (cap.get(cv2.CAP_PROP_FPS) or 25) / step
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if kwargs.get("global_palette") and kwargs.get("palette_sample") is None:
+        end_index = min(end, n_frames) if end else n_frames
+        kept = range(start, end_index, step)
+        sample_step = max(1, len(kept) // palette_frames)
+        kwargs["palette_sample"] = seek_frames(video_path, kept[::sample_step][:palette_frames], crop=crop)
+
+    write_gif(
+        video_frames(video_path, crop=crop, start=start, end=end, step=step), 
+        gif_path, 
+        duration=int(1000 / fps), 
+        **kwargs
+    )
     return gif_path
 
 
@@ -1,8 +1,7 @@
 import gradio as gr
 import os
-import shutil
 
-from img2vid import convert as img2vid_convert
+from img2vid import convert_files as img2vid_convert_files
 
 # img2vid related
 INPUT_DIR = os.environ.get("INPUT_DIR", ".")
@@ -15,28 +14,16 @@ SERVER_PORT = int(os.environ.get("SERVER_PORT", "7861"))
 
 
 def prep_dirs():
-    # create dir and remove any files currently here
-    img_dir = os.path.join(INPUT_DIR, "images")
-    os.makedirs(img_dir, exist_ok=True)
-    for file in os.listdir(img_dir):
-        os.remove(os.path.join(img_dir, file))
-
     os.makedirs(OUTPUT_DIR, exist_ok=True)   
-    
-    return img_dir, OUTPUT_PATH
-
+    return OUTPUT_PATH
 
-def copy_files(files, dest_dir):
-    for file in files:
-        shutil.copy(file, dest_dir)
-    
 
 def img2vid_interface(files):
-    img_dir, output_path = prep_dirs()
-    copy_files(files, img_dir)
+    output_path = prep_dirs()
 
-    # Convert images to video
-    img2vid_convert(img_dir, output_path)
+    # Convert images to video straight from the uploads, in filename order
+    files = sorted(files, key=os.path.basename)
+    img2vid_convert_files(files, output_path)
 
     return [
         gr.Video(label="Video", value=output_path),
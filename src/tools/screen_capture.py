@@ -1,72 +1,226 @@
-import numpy as np
-import cv2
-from mss import mss
-from PIL import Image
-import time 
-import pickle as pkl
-import os  
 from pathlib import Path
+from queue import Queue
+from threading import Semaphore, Thread
+
+import cv2
+import numpy as np
+import os
+import time
 
-from img2vid import convert
 
-# can be used to capture specific area of screen, just replace monitor var
+# can be used to capture specific area of screen, pass as bounding_box to MSSSource
 bounding_box = {'top': 100, 'left': 800, 'width': 800, 'height': 750}
 
 # frame per second
-FPS = 250
+FPS = 25
 FRAME_COUNT = 75
-
-# prep for save 
-save_dir = Path("data") / "video"
-capture_name = "aquarium"
-
-capture_number = len([f for f in os.listdir(save_dir) if f.startswith(capture_name)])
-output_dir = (save_dir / f"{capture_name}_{capture_number:03d}")
-
-os.makedirs(output_dir, exist_ok=True)
-
-
-# capture loop
-frames = []
-fps = 0
-
-with mss() as sct:
-    monitor = sct.monitors[0]#-1]  # bounding_box  
-
-    start = time.time()
-    for i in range(FRAME_COUNT):
-        sct_img = sct.grab(monitor)
-
-        img = Image.frombytes('RGB', sct_img.size, sct_img.rgb, 'raw')
-        arr = np.array(img)
-        frames.append(arr)
-
-        # cv2 swaps these for some reason? 
-        # if len(sct.monitors) > 2:
-        #     cv2.imshow(capture_name, cv2.cvtColor(arr, cv2.COLOR_RGB2BGR))
-
-        if (cv2.waitKey(1) & 0xFF) == ord('q'):
-            cv2.destroyAllWindows()
-            break
-
-        time.sleep(1.0/FPS) # at least 1/FPS seconds between every frame
-
-        print(f'Frame {i} captured ', arr.shape)
-
-    print(f"Captured {len(frames)} frames in {time.time()-start} seconds. FPS: {len(frames)/(time.time()-start)}")
-    fps = len(frames)/(time.time()-start)
-
-cv2.destroyAllWindows()
-
-# save frames as images
-
-imgs = [Image.fromarray(frame) for frame in frames]
-
-os.makedirs(output_dir, exist_ok=True)
-for j, img in enumerate(imgs):
-    img.save(output_dir / f"frame_{j:03d}.jpg", )
-
-print("capture saved at ", output_dir)
-
-# convert to video
-convert(output_dir, output_dir / f"{capture_name}_{capture_number:03d}.mp4", img_prefix="frame_", img_suffix=".jpg", fps=fps)
+BUFFER_SIZE = 16  # frames preallocated in the ring buffer
+
+
+# frame sources
+class MSSSource:
+    """Screen grabs through mss, as BGR frames."""
+
+    def __init__(self, monitor: int = 0, bounding_box: dict = None):
+        self.monitor = monitor
+        self.bounding_box = bounding_box
+
+    def __enter__(self):
+        from mss import mss
+        self.sct = mss().__enter__()
+        self.region = self.bounding_box or self.sct.monitors[self.monitor]
+        return self
+
+    def __exit__(self, *exc):
+        self.sct.__exit__(*exc)
+
+    def grab(self) -> np.ndarray:
+        # mss gives BGRA, drop alpha without going through PIL
+        return np.asarray(self.sct.grab(self.region))[:, :, :3]
+
+
+class FileSource:
+    """Stand-in for MSSSource reading frames from a video or image sequence, for headless runs."""
+
+    def __init__(self, path: str, loop: bool = True):
+        self.path = str(path)
+        self.loop = loop
+
+    def __enter__(self):
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open {self.path}")
+        return self
+
+    def __exit__(self, *exc):
+        self.capture.release()
+
+    def grab(self) -> np.ndarray:
+        ok, frame = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read()
+        return frame if ok else None
+
+
+# background encoding
+class Encoder(Thread):
+    """
+    Writes frames from the ring buffer to a video (and optionally JPEGs) while capture runs.
+    Slots are handed over through a queue as (slot, index, repeats). The last written slot is held
+    until the next one arrives, so a dropped frame (slot None) can repeat the previous frame instead.
+    """
+
+    def __init__(self, buffer: np.ndarray, free_slots: Semaphore, video_path: str, fps: float, jpg_dir: str = None):
+        super().__init__(daemon=True)
+        self.buffer = buffer
+        self.free_slots = free_slots
+        self.queue = Queue()
+        self.jpg_dir = jpg_dir
+        height, width = buffer.shape[1:3]
+        self.writer = cv2.VideoWriter(
+            str(video_path),
+            cv2.VideoWriter_fourcc(*"mp4v"),
+            fps,
+            (width, height),
+        )
+        self.written = 0
+
+    def run(self):
+        last_slot = None
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                slot, index, repeats = item
+                if slot is not None:
+                    if self.jpg_dir:
+                        cv2.imwrite(os.path.join(self.jpg_dir, f"frame_{index:03d}.jpg"), self.buffer[slot])
+                    if last_slot is not None:
+                        self.free_slots.release()
+                    last_slot = slot
+                if last_slot is None:
+                    continue
+
+                for _ in range(repeats):
+                    self.writer.write(self.buffer[last_slot])
+                    self.written += 1
+        finally:
+            self.writer.release()
+            if last_slot is not None:
+                self.free_slots.release()
+
+
+def capture(
+        source,
+        video_path: str,
+        fps: float = FPS,
+        frame_count: int = FRAME_COUNT,
+        buffer_size: int = BUFFER_SIZE,
+        jpg_dir: str = None,
+    ) -> dict:
+    """
+    Capture frame_count / fps seconds of video from source into a preallocated ring buffer,
+    encoding frames on a background thread as they come in.
+    The video is written at the target fps against a fixed schedule: when grabbing runs slower
+    than fps, each frame is repeated for the schedule slots it covered, so playback stays in real time.
+    If the encoder falls behind and the ring buffer is full, the frame is dropped rather than
+    stalling capture, and the previous frame covers its slots.
+
+    Args:
+        source: MSSSource, FileSource or anything with grab() -> BGR frame, used as a context manager
+        video_path (str): output video
+        fps (float): target capture rate, and the frame rate of the video
+        frame_count (int): frames in the output video
+        buffer_size (int): ring buffer slots, at least 2
+        jpg_dir (str): also save every frame as a JPEG here
+
+    Returns:
+        dict: captured, dropped and repeated frame counts, target and achieved (grab) fps
+    """
+    if buffer_size < 2:
+        raise ValueError("buffer_size must be at least 2, the encoder holds on to the last written frame")
+    stats = {"captured": 0, "dropped": 0, "repeated": 0, "target_fps": fps}
+    period = 1.0 / fps
+
+    with source:
+        first = source.grab()
+        buffer = np.empty((buffer_size,) + first.shape, dtype=first.dtype)
+        free_slots = Semaphore(buffer_size)
+        encoder = Encoder(buffer, free_slots, video_path, fps, jpg_dir)
+        encoder.start()
+
+        frame = first
+        slot = 0
+        i = 0  # position in the schedule, i.e. in frames of the output video
+        start = time.perf_counter()
+        while frame is not None and i < frame_count:
+            # sleep until the next frame is due instead of a fixed 1/fps on top of the work
+            delay = start + (i + 1) * period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            # the frame stays on screen until the slot in which the next grab happens
+            due = max(i + 1, int((time.perf_counter() - start) / period))
+            repeats = min(due, frame_count) - i
+
+            if free_slots.acquire(blocking=False):
+                np.copyto(buffer[slot], frame)
+                encoder.queue.put((slot, stats["captured"], repeats))
+                slot = (slot + 1) % buffer_size
+                stats["captured"] += 1
+            else:
+                encoder.queue.put((None, None, repeats))
+                stats["dropped"] += 1
+            stats["repeated"] += repeats - 1
+            i += repeats
+
+            frame = source.grab() if i < frame_count else None
+
+        elapsed = time.perf_counter() - start
+
+    encoder.queue.put(None)
+    encoder.join()
+
+    stats["achieved_fps"] = (stats["captured"] + stats["dropped"]) / elapsed if elapsed else 0.0
+    stats["written"] = encoder.written
+    stats["video_path"] = str(video_path)
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, default=None, help="video/image pattern to use instead of the screen")
+    parser.add_argument("--fps", type=float, default=FPS)
+    parser.add_argument("--frames", type=int, default=FRAME_COUNT)
+    parser.add_argument("--buffer-size", type=int, default=BUFFER_SIZE)
+    parser.add_argument("--jpgs", action="store_true", help="also save every frame as a JPEG")
+    args = parser.parse_args()
+
+    # prep for save
+    save_dir = Path("data") / "video"
+    capture_name = "aquarium"
+
+    os.makedirs(save_dir, exist_ok=True)
+    capture_number = len([f for f in os.listdir(save_dir) if f.startswith(capture_name)])
+    output_dir = (save_dir / f"{capture_name}_{capture_number:03d}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    source = FileSource(args.source) if args.source else MSSSource(monitor=0)
+    stats = capture(
+        source,
+        output_dir / f"{capture_name}_{capture_number:03d}.mp4",
+        fps=args.fps,
+        frame_count=args.frames,
+        buffer_size=args.buffer_size,
+        jpg_dir=output_dir if args.jpgs else None,
+    )
+
+    print(
+        f"Captured {stats['captured']} frames, dropped {stats['dropped']}, repeated {stats['repeated']}. "
+        f"FPS: {stats['achieved_fps']:.1f} (target {stats['target_fps']})"
+    )
+    print("capture saved at ", output_dir)
@@ -0,0 +1,265 @@
+"""
+Vectorized SORT/DeepSORT-style multi-object tracker.
+
+All track states live in contiguous NumPy arrays (means, covariances, ids, counters),
+so the Kalman predict/update steps and the cost matrices are computed for every track
+at once rather than per track object. Assignment is done with the Hungarian algorithm
+on an IoU cost matrix, gated by the Mahalanobis distance of each detection to each
+track's predicted measurement.
+
+Kalman filter setup follows DeepSORT (research/DeepSORT.pdf): state is
+(cx, cy, aspect ratio, height) plus their velocities, with noise scaled by box height.
+"""
+from scipy.optimize import linear_sum_assignment
+
+import numpy as np
+
+try:
+    from src.boxes import iou_matrix
+except ImportError:
+    from boxes import iou_matrix
+
+
+# 0.95 quantile of the chi-square distribution with 4 degrees of freedom
+CHI2_GATE_4DOF = 9.4877
+
+STD_WEIGHT_POSITION = 1.0 / 20
+STD_WEIGHT_VELOCITY = 1.0 / 160
+
+INFEASIBLE = 1e5
+
+
+def xyxy_to_xyah(xyxy: np.ndarray) -> np.ndarray:
+    w = xyxy[:, 2] - xyxy[:, 0]
+    h = xyxy[:, 3] - xyxy[:, 1]
+    return np.stack([xyxy[:, 0] + w / 2, xyxy[:, 1] + h / 2, w / np.maximum(h, 1e-6), h], axis=1)
+
+
+def xyah_to_xyxy(xyah: np.ndarray) -> np.ndarray:
+    w = xyah[:, 2] * xyah[:, 3]
+    h = xyah[:, 3]
+    return np.stack([xyah[:, 0] - w / 2, xyah[:, 1] - h / 2, xyah[:, 0] + w / 2, xyah[:, 1] + h / 2], axis=1)
+
+
+def linear_assignment(cost: np.ndarray, max_cost: float):
+    """Hungarian assignment, dropping pairs costing more than max_cost. Returns (rows, cols)."""
+    if cost.size == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    rows, cols = linear_sum_assignment(cost)
+    keep = cost[rows, cols] <= max_cost
+    return rows[keep], cols[keep]
+
+
+class KalmanTracker:
+    """
+    Multi-object tracker with batched Kalman filtering and Hungarian assignment.
+
+    Args:
+        max_age (int): frames a confirmed track survives without a matching detection
+        n_init (int): consecutive hits before a track is confirmed and reported,
+            tentative tracks are deleted on their first miss
+        min_iou (float): minimum IoU between a predicted track box and a detection to match
+        gate (float): Mahalanobis gate (squared distance), None disables gating
+        min_confidence (float): detections below this confidence do not start new tracks
+        class_aware (bool): only match detections to tracks of the same class
+    """
+
+    ndim = 4
+
+    def __init__(
+            self,
+            max_age: int = 30,
+            n_init: int = 3,
+            min_iou: float = 0.2,
+            gate: float = CHI2_GATE_4DOF,
+            min_confidence: float = 0.25,
+            class_aware: bool = False,
+        ):
+        self.max_age = max_age
+        self.n_init = n_init
+        self.min_iou = min_iou
+        self.gate = gate
+        self.min_confidence = min_confidence
+        self.class_aware = class_aware
+
+        # constant velocity model
+        self.F = np.eye(2 * self.ndim)
+        self.F[:self.ndim, self.ndim:] = np.eye(self.ndim)
+        self.H = np.eye(self.ndim, 2 * self.ndim)
+
+        self.reset()
+
+    def reset(self):
+        self.mean = np.empty((0, 2 * self.ndim))
+        self.cov = np.empty((0, 2 * self.ndim, 2 * self.ndim))
+        self.ids = np.empty(0, dtype=np.int64)
+        self.class_id = np.empty(0, dtype=np.int64)
+        self.hits = np.empty(0, dtype=np.int64)
+        self.misses = np.empty(0, dtype=np.int64)  # frames since last update
+        self.confirmed = np.empty(0, dtype=bool)
+        self.matches = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.ids)
+
+    # kalman filter, batched over tracks
+    def _std(self, h: np.ndarray, position: float, aspect: float) -> np.ndarray:
+        return np.stack([position * h, position * h, np.full_like(h, aspect), position * h], axis=1)
+
+    def initiate(self, xyah: np.ndarray):
+        h = xyah[:, 3]
+        mean = np.concatenate([xyah, np.zeros_like(xyah)], axis=1)
+        std = np.concatenate([
+            self._std(h, 2 * STD_WEIGHT_POSITION, 1e-2),
+            self._std(h, 10 * STD_WEIGHT_VELOCITY, 1e-5),
+        ], axis=1)
+        cov = np.zeros((len(xyah), 2 * self.ndim, 2 * self.ndim))
+        idx = np.arange(2 * self.ndim)
+        cov[:, idx, idx] = std ** 2
+        return mean, cov
+
+    def predict(self):
+        """Advance every track one frame."""
+        if not len(self):
+            return
+        h = self.mean[:, 3]
+        std = np.concatenate([
+            self._std(h, STD_WEIGHT_POSITION, 1e-2),
+            self._std(h, STD_WEIGHT_VELOCITY, 1e-5),
+        ], axis=1)
+
+        self.mean = self.mean @ self.F.T
+        self.cov = self.F @ self.cov @ self.F.T
+        idx = np.arange(2 * self.ndim)
+        self.cov[:, idx, idx] += std ** 2
+        self.misses += 1
+
+    def project(self, mean: np.ndarray, cov: np.ndarray):
+        """Measurement space mean (N, 4) and covariance (N, 4, 4)."""
+        std = self._std(mean[:, 3], STD_WEIGHT_POSITION, 1e-1)
+        idx = np.arange(self.ndim)
+        S = cov[:, :self.ndim, :self.ndim].copy()
+        S[:, idx, idx] += std ** 2
+        return mean[:, :self.ndim], S
+
+    def correct(self, track_idx: np.ndarray, xyah: np.ndarray):
+        """Kalman update of the tracks at track_idx with their matched measurements."""
+        mean, cov = self.mean[track_idx], self.cov[track_idx]
+        projected_mean, S = self.project(mean, cov)
+
+        PHt = cov[:, :, :self.ndim]  # P @ H.T
+        # K = P H^T S^-1, solved instead of inverted (S is symmetric)
+        K = np.linalg.solve(S, PHt.transpose(0, 2, 1)).transpose(0, 2, 1)
+        innovation = xyah - projected_mean
+
+        self.mean[track_idx] = mean + (K @ innovation[:, :, None])[:, :, 0]
+        self.cov[track_idx] = cov - K @ S @ K.transpose(0, 2, 1)
+
+    def gating_distance(self, xyah: np.ndarray) -> np.ndarray:
+        """Squared Mahalanobis distance between every track (rows) and detection (cols)."""
+        projected_mean, S = self.project(self.mean, self.cov)
+        diff = xyah[None, :, :] - projected_mean[:, None, :]
+        return np.einsum("tdi,tij,tdj->td", diff, np.linalg.inv(S), diff)
+
+    # tracking
+    def tracked_xyxy(self) -> np.ndarray:
+        return xyah_to_xyxy(self.mean[:, :self.ndim])
+
+    def cost_matrix(self, xyxy: np.ndarray, xyah: np.ndarray, class_id: np.ndarray) -> np.ndarray:
+        cost = 1 - iou_matrix(self.tracked_xyxy(), xyxy)
+        if self.gate is not None:
+            cost[self.gating_distance(xyah) > self.gate] = INFEASIBLE
+        if self.class_aware:
+            cost[self.class_id[:, None] != class_id[None, :]] = INFEASIBLE
+        return cost
+
+    def update(self, xyxy: np.ndarray, confidence: np.ndarray = None, class_id: np.ndarray = None):
+        """
+        Run one tracking step on a frame's detections.
+
+        Args:
+            xyxy (np.ndarray): (D, 4) detection boxes
+            confidence (np.ndarray): (D,) detection confidences
+            class_id (np.ndarray): (D,) detection class ids
+
+        Returns:
+            tuple: (detection indices, track ids) of detections matched to confirmed tracks
+        """
+        xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+        n = len(xyxy)
+        confidence = np.ones(n) if confidence is None else np.asarray(confidence)
+        class_id = np.zeros(n, dtype=np.int64) if class_id is None else np.asarray(class_id, dtype=np.int64)
+        xyah = xyxy_to_xyah(xyxy)
+
+        self.predict()
+
+        rows, cols = linear_assignment(
+            self.cost_matrix(xyxy, xyah, class_id) if len(self) and n else np.empty((len(self), n)),
+            max_cost=1 - self.min_iou,
+        )
+
+        # matched tracks
+        if len(rows):
+            self.correct(rows, xyah[cols])
+            self.hits[rows] += 1
+            self.misses[rows] = 0
+            self.class_id[rows] = class_id[cols]
+            self.confirmed |= self.hits >= self.n_init
+
+        # a miss breaks the run of consecutive hits, tentative tracks die on their first miss
+        self.hits[self.misses > 0] = 0
+        keep = (self.misses <= self.max_age) & (self.confirmed | (self.misses == 0))
+        matched_ids = self.ids[rows]
+        self._select(keep)
+
+        # start tracks from unmatched, confident detections
+        unmatched = np.ones(n, dtype=bool)
+        unmatched[cols] = False
+        new = np.flatnonzero(unmatched & (confidence >= self.min_confidence))
+        if len(new):
+            self._add(xyah[new], class_id[new])
+
+        # every (detection, track) pair of this step, tentative tracks included
+        self.matches = (
+            np.concatenate([cols, new]),
+            np.concatenate([matched_ids, self.ids[len(self) - len(new):]]),
+        )
+
+        # report detections whose track is confirmed
+        confirmed = np.isin(matched_ids, self.ids[self.confirmed])
+        if self.n_init <= 1 and len(new):
+            # new tracks are confirmed immediately
+            cols = np.concatenate([cols, new])
+            matched_ids = np.concatenate([matched_ids, self.ids[-len(new):]])
+            confirmed = np.concatenate([confirmed, np.ones(len(new), dtype=bool)])
+
+        return cols[confirmed], matched_ids[confirmed]
+
+    def update_with_detections(self, detections):
+        """supervision.Detections in, tracked detections with tracker_id out (same as sv.ByteTrack)."""
+        det_idx, track_ids = self.update(detections.xyxy, detections.confidence, detections.class_id)
+        tracked = detections[det_idx]
+        tracked.tracker_id = track_ids
+        return tracked
+
+    def _select(self, mask: np.ndarray):
+        self.mean = self.mean[mask]
+        self.cov = self.cov[mask]
+        self.ids = self.ids[mask]
+        self.class_id = self.class_id[mask]
+        self.hits = self.hits[mask]
+        self.misses = self.misses[mask]
+        self.confirmed = self.confirmed[mask]
+
+    def _add(self, xyah: np.ndarray, class_id: np.ndarray):
+        mean, cov = self.initiate(xyah)
+        n = len(xyah)
+        self.mean = np.concatenate([self.mean, mean])
+        self.cov = np.concatenate([self.cov, cov])
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n)])
+        self.class_id = np.concatenate([self.class_id, class_id])
+        self.hits = np.concatenate([self.hits, np.ones(n, dtype=np.int64)])
+        self.misses = np.concatenate([self.misses, np.zeros(n, dtype=np.int64)])
+        self.confirmed = np.concatenate([self.confirmed, np.full(n, self.n_init <= 1)])
+        self.next_id += n
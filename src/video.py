@@ -0,0 +1,278 @@
+"""
+Streaming video detection and tracking.
+
+Frames are decoded on a background thread into a bounded queue, run through
+(optional SR +) YOLOv5 and a tracker, and written to the output video as soon as
+they are annotated, so memory stays at a handful of frames regardless of video length.
+When the pipeline falls behind real time, or a KeyframeSelector decides a frame is
+a near-duplicate of the last keyframe, detection is skipped and the last tracked boxes
+are moved along their estimated velocity instead.
+"""
+from queue import Queue
+from threading import Event, Thread
+from time import perf_counter
+from typing import Any, Callable
+
+import cv2
+import numpy as np
+import supervision as sv
+
+try:
+    from src.instrumentation import span
+except ImportError:
+    from instrumentation import span
+
+
+_END = object()  # end-of-stream marker
+
+
+class FrameReader(Thread):
+    """Decode frames from a video into a bounded queue on a background thread."""
+
+    def __init__(self, source_path: str, queue_size: int = 8):
+        super().__init__(daemon=True)
+        self.capture = cv2.VideoCapture(str(source_path))
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video {source_path}")
+
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.size = (
+            int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        )
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.queue = Queue(maxsize=queue_size)
+        self.stopped = Event()
+
+    def run(self):
+        index = 0
+        try:
+            while not self.stopped.is_set():
+                with span("video.decode"):
+                    ok, frame = self.capture.read()
+                if not ok:
+                    break
+                self.queue.put((index, frame))  # blocks while the consumer is behind
+                index += 1
+        finally:
+            self.capture.release()
+            self.queue.put(_END)
+
+    def stop(self):
+        self.stopped.set()
+        # drain so a blocked put() can see the stop flag
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                return
+            yield item
+
+
+class KeyframeSelector:
+    """
+    Decide which frames need full SR + detection by comparing cheap, downscaled
+    grayscale thumbnails against the last keyframe.
+
+    Args:
+        threshold (float): mean absolute pixel difference (0-255) that makes a new keyframe
+        max_interval (int): force a keyframe at least every max_interval frames
+        size (int): width of the thumbnail used for differencing
+    """
+
+    def __init__(self, threshold: float = 4.0, max_interval: int = 15, size: int = 64):
+        self.threshold = threshold
+        self.max_interval = max_interval
+        self.size = size
+        self.reference = None
+        self.since_keyframe = 0
+        self.last_diff = 0.0
+
+    def thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.size, max(1, h * self.size // w)), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.int16)
+
+    def __call__(self, frame: np.ndarray) -> bool:
+        thumb = self.thumbnail(frame)
+        self.since_keyframe += 1
+
+        if self.reference is None or self.since_keyframe >= self.max_interval:
+            is_keyframe = True
+        else:
+            self.last_diff = float(np.abs(thumb - self.reference).mean())
+            is_keyframe = self.last_diff > self.threshold
+
+        if is_keyframe:
+            self.reference = thumb
+            self.since_keyframe = 0
+        return is_keyframe
+
+
+class VideoTracker:
+    """
+    Detection (with optional SR) + tracking + annotation for single video frames.
+
+    Args:
+        model: YOLOv5ModelWithUpsample, or anything with a forward_frames method
+        tracker: object with update_with_detections, defaults to supervision's ByteTrack
+        label_map (LabelMap): remap detector classes (e.g. Benthic -> TrashCAN) before tracking
+        **tracker_params: passed to sv.ByteTrack when no tracker is given
+    """
+
+    def __init__(self, model, tracker=None, label_map=None, **tracker_params):
+        self.model = model
+        self.label_map = label_map
+        self.tracker = tracker if tracker is not None else sv.ByteTrack(**tracker_params)
+        self.box_annotator = sv.BoundingBoxAnnotator()
+        self.label_annotator = sv.LabelAnnotator()
+        self.detections = sv.Detections.empty()
+
+        # constant velocity motion model for frames where detection is skipped
+        self.history = {}  # tracker_id -> (frame index, xyxy)
+        self.base_xyxy = np.empty((0, 4))
+        self.velocity = np.empty((0, 4))
+        self.last_index = 0
+
+    def detect(self, frame: np.ndarray) -> sv.Detections:
+        results, scale = self.model.forward_frames([frame])
+        detections = sv.Detections.from_yolov5(results)
+        if self.label_map is not None:
+            detections.class_id = self.label_map.remap(detections.class_id)
+        if scale != 1:
+            # SR output is larger than the frame we draw on
+            detections.xyxy = detections.xyxy / scale
+        return detections
+
+    def update(self, frame: np.ndarray, index: int = 0) -> sv.Detections:
+        with span("video.detect"):
+            detections = self.detect(frame)
+        with span("video.track"):
+            if getattr(self.tracker, "needs_frame", False):
+                # appearance based trackers embed crops of the frame
+                self.detections = self.tracker.update_with_detections(detections, frame=frame)
+            else:
+                self.detections = self.tracker.update_with_detections(detections)
+            self.update_motion(index)
+        return self.detections
+
+    def update_motion(self, index: int) -> None:
+        """Estimate per-track box velocity (pixels per frame) from the previous detection of each track."""
+        xyxy = self.detections.xyxy.astype(np.float64)
+        velocity = np.zeros_like(xyxy)
+
+        if self.detections.tracker_id is not None:
+            history = {}
+            for i, tracker_id in enumerate(self.detections.tracker_id):
+                if tracker_id in self.history:
+                    prev_index, prev_xyxy = self.history[tracker_id]
+                    velocity[i] = (xyxy[i] - prev_xyxy) / max(index - prev_index, 1)
+                history[tracker_id] = (index, xyxy[i])
+            self.history = history
+
+        self.base_xyxy = xyxy
+        self.velocity = velocity
+        self.last_index = index
+
+    def propagate(self, index: int) -> sv.Detections:
+        """Move the last tracked boxes to frame index without running detection."""
+        if len(self.detections):
+            self.detections.xyxy = self.base_xyxy + self.velocity * (index - self.last_index)
+        return self.detections
+
+    def annotate(self, frame: np.ndarray, detections: sv.Detections = None) -> np.ndarray:
+        detections = self.detections if detections is None else detections
+        names = self.model.names if self.label_map is None else self.label_map.names
+        tracker_ids = detections.tracker_id if detections.tracker_id is not None else [None] * len(detections)
+        labels = [
+            f"#{tracker_id} {names.get(int(class_id), int(class_id))} {confidence:0.2f}"
+            for confidence, class_id, tracker_id
+            in zip(detections.confidence, detections.class_id, tracker_ids)
+        ]
+        frame = self.box_annotator.annotate(scene=frame.copy(), detections=detections)
+        return self.label_annotator.annotate(scene=frame, detections=detections, labels=labels)
+
+
+def process_video(
+        source_path: str,
+        target_path: str,
+        video_tracker: VideoTracker,
+        queue_size: int = 8,
+        adaptive_skip: bool = True,
+        max_lag: float = 0.5,
+        detect_every: int = 1,
+        keyframes: KeyframeSelector = None,
+        callback: Callable[[int, dict], Any] = None,
+    ) -> dict:
+    """
+    Run detection + tracking over a video and write the annotated result on the fly.
+
+    Args:
+        source_path (str): input video
+        target_path (str): output video (mp4)
+        video_tracker (VideoTracker): detection/tracking/annotation for each frame
+        queue_size (int): max decoded frames waiting to be processed
+        adaptive_skip (bool): skip detection on frames once we are more than max_lag seconds behind real time
+        max_lag (float): allowed lag behind real time in seconds
+        detect_every (int): only run detection on every n-th frame
+        keyframes (KeyframeSelector): only run detection on frames that changed enough since the last keyframe
+        callback (callable): called with (frame_index, stats) after every written frame
+
+    Returns:
+        dict: frame counts, fraction of frames where SR + detection was saved, frames/sec and the output path
+
+    source_path can also be an image sequence pattern understood by cv2.VideoCapture, 
+    e.g. "data/example/mba/frame_%03d.jpg".
+    """
+    reader = FrameReader(source_path, queue_size=queue_size)
+    writer = cv2.VideoWriter(
+        str(target_path),
+        cv2.VideoWriter_fourcc(*"mp4v"),
+        reader.fps,
+        reader.size,
+    )
+    period = 1.0 / reader.fps
+    stats = {"frames": 0, "detected": 0, "skipped": 0, "reused": 0}
+
+    reader.start()
+    start = perf_counter()
+    try:
+        for index, frame in reader:
+            lag = (perf_counter() - start) - index * period
+            late = adaptive_skip and lag > max_lag
+
+            if index % detect_every != 0 or late:
+                video_tracker.propagate(index)
+                stats["skipped"] += 1
+            elif keyframes is not None and not keyframes(frame):
+                video_tracker.propagate(index)
+                stats["reused"] += 1
+            else:
+                video_tracker.update(frame, index)
+                stats["detected"] += 1
+
+            with span("video.write"):
+                writer.write(video_tracker.annotate(frame))
+            stats["frames"] += 1
+
+            if callback:
+                callback(index, stats)
+    finally:
+        reader.stop()
+        writer.release()
+
+    elapsed = perf_counter() - start
+    stats.update({
+        "time": elapsed,
+        "fps": stats["frames"] / elapsed if elapsed else 0.0,
+        "detection_fps": stats["detected"] / elapsed if elapsed else 0.0,
+        "saved_fraction": 1 - stats["detected"] / stats["frames"] if stats["frames"] else 0.0,
+        "source_fps": reader.fps,
+        "output_path": str(target_path),
+    })
+    return stats
@@ -0,0 +1,150 @@
+"""
+Memory-mapped weights for the SR and detector models.
+
+Checkpoints are converted once into a plain tensor state dict saved next to the original
+(RealESRGAN_x4plus.pth -> RealESRGAN_x4plus.mmap.pt). Loading that file with mmap=True maps
+the tensors straight from the page cache instead of unpickling them into fresh memory, and
+load_state_dict(assign=True) makes the module use those pages directly. Worker processes on
+one host then share a single copy of the weights, and loads after the first are close to free.
+
+The yolov5 detector is different: the hub loader fuses every Conv's BatchNorm into the conv,
+so its state dict no longer matches the checkpoint. Its converted file is made from the loaded
+module instead (load_weights(..., from_module=True)), on the first
+YOLOv5ModelWithUpsample(mmap_weights=True). The CLI only converts plain tensor checkpoints:
+
+    python -m src.weights models/ESRGAN/RealESRGAN_x4plus.pth
+"""
+from pathlib import Path
+
+import os
+import torch
+
+try:
+    from src.instrumentation import span
+except ImportError:
+    from instrumentation import span
+
+
+MMAP_SUFFIX = ".mmap.pt"
+
+
+def mmap_path(checkpoint_path: str) -> str:
+    path = Path(checkpoint_path)
+    return str(path.with_name(path.stem + MMAP_SUFFIX))
+
+
+def extract_state_dict(checkpoint) -> dict:
+    """
+    Pull the tensors out of the checkpoint layouts we use:
+    basicsr/RealESRGAN/HAT ("params_ema" or "params"), or a plain/nested state dict.
+    """
+    for key in ["params_ema", "params", "model", "state_dict"]:
+        if isinstance(checkpoint, dict) and checkpoint.get(key) is not None:
+            return extract_state_dict(checkpoint[key])
+
+    if isinstance(checkpoint, dict) and all(isinstance(v, torch.Tensor) for v in checkpoint.values()):
+        return checkpoint
+
+    raise ValueError("Could not find a state dict in checkpoint")
+
+
+def save_state_dict(state_dict: dict, output_path: str) -> str:
+    """Save contiguous tensors to a mmap-able file, via a rename so readers never see half a file."""
+    state_dict = {k: v.detach().contiguous() for k, v in state_dict.items()}
+    tmp = f"{output_path}.{os.getpid()}.tmp"
+    torch.save(state_dict, tmp)
+    os.replace(tmp, output_path)
+    return output_path
+
+
+def convert_checkpoint(checkpoint_path: str, output_path: str = None) -> str:
+    """Save the checkpoint's state dict as contiguous tensors in a mmap-able file."""
+    output_path = output_path or mmap_path(checkpoint_path)
+
+    try:
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=True)
+    except Exception as e:
+        # yolov5 checkpoints pickle whole modules, and their weights change when loaded (Conv + BN fusing)
+        raise ValueError(
+            f"{checkpoint_path} is not a plain tensor checkpoint ({type(e).__name__}). For the yolov5 detector "
+            "use YOLOv5ModelWithUpsample(mmap_weights=True), which converts the loaded network instead."
+        ) from e
+    save_state_dict(extract_state_dict(checkpoint), output_path)
+    print(f"Converted {checkpoint_path} -> {output_path}")
+    return output_path
+
+
+def convert_module(module: torch.nn.Module, checkpoint_path: str, output_path: str = None) -> str:
+    """
+    Save an already loaded module's state dict as the converted file for checkpoint_path,
+    for modules whose layout changes on load (yolov5 fuses Conv + BatchNorm).
+    """
+    output_path = output_path or mmap_path(checkpoint_path)
+    save_state_dict(module.state_dict(), output_path)
+    print(f"Converted loaded {type(module).__name__} of {checkpoint_path} -> {output_path}")
+    return output_path
+
+
+def _converted_path(checkpoint_path: str) -> str:
+    return checkpoint_path if checkpoint_path.endswith(MMAP_SUFFIX) else mmap_path(checkpoint_path)
+
+
+def _is_stale(path: str, checkpoint_path: str) -> bool:
+    return not os.path.isfile(path) or (
+        path != checkpoint_path and os.path.getmtime(path) < os.path.getmtime(checkpoint_path)
+    )
+
+
+def load_state_dict(checkpoint_path: str, convert: bool = True, module: torch.nn.Module = None) -> dict:
+    """
+    Memory-mapped state dict for checkpoint_path, converting first if there is no up to date
+    converted file yet (and convert is set). The conversion uses module's own state dict when
+    given (see convert_module), the checkpoint's otherwise.
+    """
+    path = _converted_path(checkpoint_path)
+
+    if _is_stale(path, checkpoint_path):
+        if not convert:
+            raise FileNotFoundError(f"No converted weights at {path}, run python -m src.weights {checkpoint_path}")
+        if module is not None:
+            convert_module(module, checkpoint_path, path)
+        else:
+            convert_checkpoint(checkpoint_path, path)
+
+    with span("weights.load"):
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def load_weights(
+        module: torch.nn.Module,
+        checkpoint_path: str,
+        strict: bool = True,
+        convert: bool = True,
+        from_module: bool = False,
+    ) -> torch.nn.Module:
+    """
+    Point module's parameters and buffers at the memory-mapped tensors (no copy).
+    With from_module, the converted file is made from the loaded module itself, and remade
+    if its keys don't match the module's (e.g. an older conversion of the unfused checkpoint).
+    """
+    state_dict = load_state_dict(checkpoint_path, convert=convert, module=module if from_module else None)
+
+    if from_module and set(state_dict) != set(module.state_dict()):
+        if not convert:
+            raise RuntimeError(f"Converted weights for {checkpoint_path} don't match {type(module).__name__}")
+        del state_dict
+        convert_module(module, checkpoint_path, _converted_path(checkpoint_path))
+        state_dict = load_state_dict(checkpoint_path, convert=False)
+
+    module.load_state_dict(state_dict, strict=strict, assign=True)
+    return module
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1:
+        for checkpoint_path in sys.argv[1:]:
+            convert_checkpoint(checkpoint_path)
+    else:
+        print("Usage: python -m src.weights <checkpoint> [<checkpoint> ...]")
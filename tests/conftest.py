@@ -0,0 +1,5 @@
+import os
+import sys
+
+# tests import modules as src.<module>, the same way python -m src.benchmark does from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("fathomnet")
+pytest.importorskip("pycocotools")
+
+from src.evaluation import evaluate_bboxes, match_bboxes
+from src.labels import LabelMap
+
+
+def random_boxes(rng, n, n_classes, with_conf):
+    xy = rng.integers(0, 60, (n, 2))
+    wh = rng.integers(5, 30, (n, 2))
+    classes = rng.integers(0, n_classes, (n, 1))
+    columns = [xy, xy + wh] + ([rng.random((n, 1))] if with_conf else []) + [classes]
+    return [list(box) for box in np.hstack(columns).tolist()]
+
+
+def random_case(rng):
+    n_classes = int(rng.integers(2, 8))
+    settings = dict(
+        id_map={int(k): int(rng.integers(0, n_classes)) for k in rng.choice(n_classes, rng.integers(0, n_classes))},
+        one_idx=int(rng.integers(0, n_classes)),  # often inside many_idx too
+        many_idx=[int(i) for i in rng.choice(n_classes, rng.integers(0, n_classes), replace=False)],
+        exclude_ids=[int(i) for i in rng.choice(n_classes, rng.integers(0, 3), replace=False)],
+    )
+    scale = dict(zip(["x_scale", "y_scale"], rng.choice([1.0, 0.5, 2.0], 2)))
+    preds = random_boxes(rng, int(rng.integers(0, 12)), n_classes, with_conf=True)
+    trues = random_boxes(rng, int(rng.integers(0, 12)), n_classes, with_conf=False)
+    return settings, scale, preds, trues
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_vectorized_matching_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(500):
+        settings, scale, preds, trues = random_case(rng)
+        trues_loop, trues_vectorized = [list(t) for t in trues], [list(t) for t in trues]
+
+        expected = match_bboxes(preds, trues_loop, iou_threshold=0.5, **settings, **scale)
+        actual = match_bboxes(preds, trues_vectorized, iou_threshold=0.5, label_map=LabelMap(**settings), **scale)
+
+        assert trues_vectorized == trues_loop
+        assert len(actual) == len(expected)
+        for (c1, i1, m1), (c2, i2, m2) in zip(expected, actual):
+            assert (c2, m2) == (c1, m1)
+            assert i2 == pytest.approx(i1, abs=1e-9)
+
+
+def test_vectorized_matching_never_matches_without_overlap():
+    # documented difference: match_bboxes would count this as a match at iou_threshold=0
+    trues = [[100, 100, 110, 110, 1]]
+    matches = match_bboxes([[0, 0, 10, 10, 0.9, 1]], trues, iou_threshold=0, label_map=LabelMap({}))
+
+    assert matches == [(1, 0.0, False)]
+    assert trues == [[100, 100, 110, 110, 1]]
+
+
+def test_evaluate_bboxes_returns_ints_for_tensor_predictions():
+    preds = torch.tensor([[0, 0, 10, 10, 0.9, 1.0], [50, 50, 60, 60, 0.8, 2.0]])
+    tp, fp, fn, _ = evaluate_bboxes(preds, [[0, 0, 10, 10, 1], [30, 30, 40, 40, 2]])
+
+    assert (tp, fp, fn) == (1, 1, 1)
+    assert all(type(v) is int for v in (tp, fp, fn))
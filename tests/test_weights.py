@@ -0,0 +1,85 @@
+from pathlib import Path
+
+import os
+import pytest
+import torch
+
+from src.weights import convert_checkpoint, load_weights, mmap_path
+
+
+DETECTOR_PATH = os.environ.get("DETECTOR_PATH", "models/fathomnet_benthic/mbari-mb-benthic-33k.pt")
+EXAMPLE_IMAGES = sorted(str(p) for p in Path("data/example/mba").glob("*.jpg"))[:4]
+
+
+class ConvBN(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(3, 4, 3, bias=False)
+        self.bn = torch.nn.BatchNorm2d(4)
+
+    def forward(self, x):
+        return self.bn(self.conv(x)) if hasattr(self, "bn") else self.conv(x)
+
+    def fuse(self):
+        # what yolov5's loader does to every Conv
+        std = (self.bn.running_var + self.bn.eps).sqrt()
+        conv = torch.nn.Conv2d(3, 4, 3)
+        conv.weight.data = self.conv.weight * (self.bn.weight / std)[:, None, None, None]
+        conv.bias.data = self.bn.bias - self.bn.weight * self.bn.running_mean / std
+        self.conv = conv
+        del self.bn
+        return self
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    model = ConvBN().eval()
+    model.bn.running_mean.uniform_()
+    path = str(tmp_path / "model.pth")
+    torch.save({"params_ema": model.state_dict()}, path)
+    return path, model
+
+
+def test_load_weights_maps_converted_checkpoint(checkpoint):
+    path, model = checkpoint
+    x = torch.rand(1, 3, 8, 8)
+
+    loaded = load_weights(ConvBN().eval(), path)
+
+    assert os.path.isfile(mmap_path(path))
+    assert torch.allclose(loaded(x), model(x))
+
+
+def test_load_weights_from_fused_module_replaces_unfused_conversion(checkpoint):
+    path, model = checkpoint
+    x = torch.rand(1, 3, 8, 8)
+    expected = model(x)
+    convert_checkpoint(path)  # stale conversion with bn.* keys and no conv.bias
+
+    for _ in range(2):  # the second load reuses the fused conversion
+        fused = ConvBN().eval()
+        fused.load_state_dict(model.state_dict())
+        fused = load_weights(fused.fuse(), path, from_module=True)
+        assert "conv.bias" in torch.load(mmap_path(path), mmap=True, weights_only=True)
+        assert torch.allclose(fused(x), expected, atol=1e-5)
+
+
+def test_convert_checkpoint_rejects_pickled_modules(tmp_path):
+    path = str(tmp_path / "detector.pt")
+    torch.save({"model": ConvBN()}, path)
+
+    with pytest.raises(ValueError, match="mmap_weights=True"):
+        convert_checkpoint(path)
+
+
+@pytest.mark.skipif(not os.path.isfile(DETECTOR_PATH), reason="detector weights not available")
+def test_detector_with_mmap_weights_matches_eager():
+    pytest.importorskip("fathomnet")
+    from src.super_resolution import YOLOv5ModelWithUpsample
+
+    eager = YOLOv5ModelWithUpsample(DETECTOR_PATH).forward(EXAMPLE_IMAGES)
+    mapped = YOLOv5ModelWithUpsample(DETECTOR_PATH, mmap_weights=True).forward(EXAMPLE_IMAGES)
+
+    for a, b in zip(eager.xyxy, mapped.xyxy):
+        assert a.shape == b.shape
+        assert torch.allclose(a, b, atol=1e-4)